@@ -0,0 +1,132 @@
+from typing import List
+
+import numpy as np
+
+from drone import Drone
+from hover import Hover
+from polar_utils import angles_between
+from rlutilities.linear_algebra import mat3, vec3
+
+Z = np.array([0.0, 0.0, 1.0])
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+def look_at_rows(forward: np.ndarray, up: np.ndarray = Z) -> np.ndarray:
+    """
+    Vectorized look_at, shape (n, 3, 3) with forward, left and up as columns
+    """
+    f = normalize_rows(forward)
+    u = normalize_rows(np.cross(f, np.cross(np.broadcast_to(up, f.shape), f)))
+    left = normalize_rows(np.cross(u, f))
+    return np.stack([f, left, u], axis=2)
+
+
+def directions_on_circle(positions: np.ndarray, direction: vec3) -> np.ndarray:
+    """
+    The same direction in the polar frame of every position: x towards the center, y along the circle, z up
+    """
+    towards_center = -normalize_rows(positions)
+    tangent = normalize_rows(np.cross(towards_center, Z))
+    return direction[0] * towards_center + direction[1] * tangent + direction[2] * Z
+
+
+def positions_on_circle(positions: np.ndarray, radii: np.ndarray, angle_offset: float) -> np.ndarray:
+    """
+    The positions moved along their circle by angle_offset, at the given radii
+    """
+    c, s = np.cos(angle_offset), np.sin(angle_offset)
+    n = normalize_rows(positions)
+    rotated = np.stack([c * n[:, 0] - s * n[:, 1], s * n[:, 0] + c * n[:, 1], n[:, 2]], axis=1)
+    return rotated * radii[:, None]
+
+
+def drone_rows(drones: List[Drone]) -> List[int]:
+    return [drone.id for drone in drones]
+
+
+def positions_of(drones: List[Drone]) -> np.ndarray:
+    return drones[0].snapshot.positions[drone_rows(drones)].astype(float)
+
+
+def reorient_all(drones: List[Drone], targets: np.ndarray):
+    """
+    reorient() for a group of drones, targets is (n, 3, 3).
+    Reorient is native, so only its step runs per drone, the target matrices and the yaw override are batched.
+    """
+    if not drones:
+        return
+    forwards = drones[0].snapshot.orientations[drone_rows(drones), :, 0].astype(float)
+    forwards[:, 2] = 0.0
+    target_forwards = targets[:, :, 0].copy()
+    target_forwards[:, 2] = 0.0
+    turn_around = (angles_between(forwards, target_forwards) > 3.0).tolist()
+
+    for drone, target, yaw in zip(drones, targets.reshape(-1, 9).tolist(), turn_around):
+        drone.sync()
+        drone.reorient.target_orientation = mat3(*target)
+        drone.reorient.step(1 / 120)
+        drone.controls = drone.reorient.controls
+        if yaw:
+            drone.controls.yaw = 1.0
+
+
+def drive_all(drones: List[Drone], targets: np.ndarray, speed: float):
+    """
+    drive() for a group of drones, targets is (n, 3)
+    """
+    for drone, target in zip(drones, targets.tolist()):
+        drone.sync()
+        drone.drive.target = vec3(*target)
+        drone.drive.speed = speed
+        drone.drive.step(1 / 120)
+        drone.controls = drone.drive.controls
+
+
+def hover_all(drones: List[Drone], targets: np.ndarray, ups: np.ndarray):
+    """
+    hover() for a group of drones with the PD maths of Hover.step done for all of them at once,
+    targets and ups are (n, 3)
+    """
+    if not drones:
+        return
+    rows = drone_rows(drones)
+    snapshot = drones[0].snapshot
+    positions = snapshot.positions[rows].astype(float)
+    velocities = snapshot.velocities[rows].astype(float)
+
+    delta = targets - positions
+    distances = np.linalg.norm(delta, axis=1, keepdims=True)
+    clamped = np.where(distances > 300, normalize_rows(delta) * 300, delta)
+    directions = np.empty_like(delta)
+    directions[:, :2] = clamped[:, :2] * Hover.P - velocities[:, :2] * Hover.D
+    directions[:, 2] = 1000
+    orientations = look_at_rows(directions, ups)
+
+    # tap boost to keep height
+    boosting = (delta[:, 2] - velocities[:, 2] * 0.5 > 0).tolist()
+    z = positions[:, 2]
+    low = (z < 100).tolist()
+    hop = ((150 < z) & (z < 200)).tolist()
+
+    for drone, target, up, orientation, boost, low, hop in zip(
+            drones, targets.tolist(), ups.tolist(), orientations.reshape(-1, 9).tolist(), boosting, low, hop):
+        drone.sync()
+        hover = drone.hover
+        hover.target = vec3(*target)
+        hover.up = vec3(*up)
+        hover.reorient.target_orientation = mat3(*orientation)
+        hover.reorient.step(1 / 120)
+        controls = hover.controls = hover.reorient.controls
+        controls.boost = boost
+        controls.jump = low or hop
+        if hop:
+            controls.pitch = 0
+            controls.yaw = 0
+            controls.roll = 0
+        # assigning to the car copies the input, so only once it's complete
+        drone.controls = controls
+
@@ -0,0 +1,199 @@
+import argparse
+import json
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Type
+
+import numpy as np
+
+import choreography
+import evaluation
+import steps
+from headless import HeadlessGame
+from input_transport import InputBuffer
+from polar_utils import formation_geometry
+from profiling import TickProfiler
+from recording import PacketReplay, ReplayInterface
+from step_runner import StepRunner
+from steps import Step, CompositeStep, ParallelStep, PartialStep, Wait
+
+TICK_BUDGET_MS = 1000 / 120
+PERCENTILES = [50, 90, 99]
+
+
+CONTAINERS = (CompositeStep, ParallelStep, PartialStep)
+
+
+class StepTimer(TickProfiler):
+    """
+    Adds up the self time of the steps per class within a tick, the children of a step are timed on their own.
+    The plain containers are left out, they are never the interesting part.
+    """
+
+    def __init__(self):
+        super().__init__(Path())
+        self.tick_times: Dict[str, float] = defaultdict(float)
+
+    def record_step(self, step: Step, elapsed: float, self_elapsed: float):
+        if type(step) not in CONTAINERS:
+            self.tick_times[type(step).__name__] += self_elapsed
+
+
+def leaf_step_classes() -> List[Type[Step]]:
+    classes = []
+    for module in (steps, evaluation, choreography):
+        for value in vars(module).values():
+            if isinstance(value, type) and issubclass(value, Step) and value.__module__ == module.__name__ \
+                    and value is not Step and value not in CONTAINERS:
+                classes.append(value)
+    return classes
+
+
+def runner_class(bot_count: int) -> Type[StepRunner]:
+    if bot_count < 64:
+        return choreography.Choreography
+    return type("BenchmarkChoreography", (choreography.Choreography,), {
+        "geometry": formation_geometry(slot_count=bot_count + 1),
+    })
+
+
+def isolated_runner_class(base: Type[StepRunner], step_class: Type[Step]) -> Type[StepRunner]:
+    def generate_sequence(self):
+        step = step_class(steps=[Wait(1.0)]) if issubclass(step_class, CompositeStep) else step_class(duration=1.0)
+        self.step = CompositeStep(steps=[choreography.SetCircle(), Wait(0.5), step])
+
+    return type(f"Isolated{step_class.__name__}", (base,), {"generate_sequence": generate_sequence})
+
+
+def measure(runner_class: Type[StepRunner], bot_count: int, max_seconds: float,
+            latencies: Dict[str, List[float]], timer: StepTimer):
+    """
+    Runs one full sequence of the runner on a headless game and adds the latencies of every tick
+    """
+    game = HeadlessGame(bot_count)
+    packet = game.wait_game_tick_packet()
+    runner = runner_class(game.game_interface, packet)
+    start_time = game.simulation.time
+    started = False
+
+    while game.simulation.time - start_time < max_seconds:
+        controls = measure_tick(runner, packet, latencies, timer)
+        controls.submit(game.game_interface)
+
+        if runner.step is None and started:
+            break
+        started = True
+        packet = game.wait_game_tick_packet()
+
+
+def measure_recording(runner_class: Type[StepRunner], directory: Path, latencies: Dict[str, List[float]],
+                      timer: StepTimer):
+    """
+    Same as measure, but on the packets of a recorded show
+    """
+    runner = None
+    for packet in PacketReplay(directory).packets():
+        if runner is None:
+            runner = runner_class(ReplayInterface(), packet)
+        measure_tick(runner, packet, latencies, timer)
+
+
+def measure_tick(runner: StepRunner, packet, latencies: Dict[str, List[float]], timer: StepTimer) -> InputBuffer:
+    """
+    The whole get_outputs goes into "tick", each step class that was performed gets its own time
+    """
+    timer.tick_times.clear()
+    start = time.perf_counter()
+    controls = runner.get_outputs(packet)
+    latencies["tick"].append((time.perf_counter() - start) * 1000)
+
+    for section, elapsed in timer.tick_times.items():
+        latencies[section].append(elapsed * 1000)
+    return controls
+
+
+def summarize(latencies: Dict[str, List[float]]) -> Dict[str, Dict[str, float]]:
+    summary = {}
+    for section, values in sorted(latencies.items()):
+        values = np.array(values)
+        stats = {f"p{p}": float(np.percentile(values, p)) for p in PERCENTILES}
+        stats["max"] = float(values.max())
+        stats["ticks"] = len(values)
+        stats["over_budget"] = int((values > TICK_BUDGET_MS).sum())
+        summary[section] = stats
+    return summary
+
+
+def print_summary(summary: Dict[str, Dict[str, float]]):
+    print(f"{'section':<22}{'ticks':>8}" + "".join(f"{f'p{p} ms':>10}" for p in PERCENTILES) +
+          f"{'max ms':>10}{'p99/budget':>12}{'over':>7}")
+    for section, stats in summary.items():
+        print(f"{section:<22}{stats['ticks']:>8}" + "".join(f"{stats[f'p{p}']:>10.3f}" for p in PERCENTILES) +
+              f"{stats['max']:>10.3f}{stats['p99'] / TICK_BUDGET_MS:>11.0%}{stats['over_budget']:>7}")
+
+
+def find_regressions(summary, baseline, metric: str, threshold: float) -> List[str]:
+    regressions = []
+    for section, stats in summary.items():
+        if section in baseline and stats[metric] > baseline[section][metric] * (1 + threshold):
+            regressions.append(f"{section}: {metric} {baseline[section][metric]:.3f} ms -> {stats[metric]:.3f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tick latency of Choreography.get_outputs and the time of each step class in it")
+    parser.add_argument("--bots", type=int, default=63, help="formation size, can be more than 64")
+    parser.add_argument("--seconds", type=float, default=float("inf"), help="cut the show short")
+    parser.add_argument("--recording", help="measure on a recorded show instead of the headless simulation")
+    parser.add_argument("--save", help="write the results as json")
+    parser.add_argument("--baseline", help="json from an earlier --save to compare against")
+    parser.add_argument("--metric", default="p99", choices=[f"p{p}" for p in PERCENTILES] + ["max"])
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed relative regression")
+    parser.add_argument("--fail-over-budget", action="store_true",
+                        help="also fail when any section's metric is over the 120 Hz budget")
+    args = parser.parse_args()
+
+    base = runner_class(args.bots)
+    latencies = defaultdict(list)
+    timer = StepTimer()
+    timer.install_steps()
+    try:
+        if args.recording:
+            measure_recording(choreography.Choreography, Path(args.recording), latencies, timer)
+        else:
+            measure(base, args.bots, args.seconds, latencies, timer)
+
+            # step types the show doesn't use still get a short run of their own
+            for step_class in leaf_step_classes():
+                if step_class.__name__ not in latencies:
+                    measure(isolated_runner_class(base, step_class), args.bots, 5.0, latencies, timer)
+    finally:
+        timer.uninstall()
+
+    summary = summarize(latencies)
+    print_summary(summary)
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump({"bots": args.bots, "sections": summary}, file, indent=2)
+
+    failures = []
+    if args.baseline:
+        with open(args.baseline) as file:
+            failures += find_regressions(summary, json.load(file)["sections"], args.metric, args.threshold)
+    if args.fail_over_budget:
+        failures += [f"{section}: {args.metric} {stats[args.metric]:.3f} ms is over the budget"
+                     for section, stats in summary.items() if stats[args.metric] > TICK_BUDGET_MS]
+
+    if failures:
+        print()
+        print("-----------------REGRESSIONS-----------------")
+        for failure in failures:
+            print(failure)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,190 +1,35 @@
+import os
 from dataclasses import dataclass
-from math import pi
 
+import numpy as np
 from rlbot.utils.game_state_util import BallState, Physics, Vector3, CarState
 
-from drone import reorient, drive, hover
-from evaluation import EvaluateStep, RepairFormation, DisplayScore, DisplayText
-from polar_utils import rotation, circle_radius, circle_pos, direction_on_circle, position_on_circle, \
-    inner_group_bot_count
+from batch_control import reorient_all, drive_all, hover_all, look_at_rows, directions_on_circle, \
+    positions_on_circle, positions_of, Z
 from rlutilities.linear_algebra import vec3, look_at, dot, vec2, \
     sgn
 from rlutilities.simulation import Game
+from show_format import load_show, show_path
 from step_runner import StepRunner
-from steps import Step, StepResult, CompositeStep, Wait, ParallelStep, PartialStep, StepContext, \
-    make_physics, vec3_to_vector3
+from steps import Step, StepResult, StepContext, make_physics, vec3_to_vector3
 
 Game.set_mode("soccar")
 
 
 class Choreography(StepRunner):
-    choreo_human_index = 40
+    # AIRSHOW_SHOW=<name or path>: which show to perform, the name of a file in shows/ or a path to one
+    show = os.environ.get("AIRSHOW_SHOW", "airshow")
 
     def generate_sequence(self):
-        def airshow(includes_player):
-            repair = lambda: CompositeStep(steps=[
-                RepairFormation(include_player=includes_player),
-                Wait(0.5),
-            ])
-
-            return [
-
-                # JUMP TWICE
-                JumpAndTurn(direction=vec2(1, 0)),
-                repair(),
-                JumpAndTurn(direction=vec2(1, 0)),
-                repair(),
-
-                # JUMP TURN BACK AND FORTH
-                JumpAndTurn(direction=vec2(-1, 0)),
-                repair(),
-                JumpAndTurn(direction=vec2(1, 0)),
-                repair(),
-
-                # DODGE FORWARD AND BACK
-                JumpAndDodge(direction=vec2(1, 0)),
-                Wait(2.0),
-                repair(),
-                JumpAndDodge(direction=vec2(-1, 0)),
-                Wait(2.0),
-                repair(),
-
-                # DODGE FORWARD AND BACK
-                JumpAndDodge(direction=vec2(1, 0)),
-                Wait(2.0),
-                repair(),
-                JumpAndDodge(direction=vec2(-1, 0)),
-                Wait(2.0),
-                repair(),
-
-                # DODGE LEFT AND RIGHT
-                JumpAndDodge(direction=vec2(0, -1)),
-                Wait(2.0),
-                repair(),
-                JumpAndDodge(direction=vec2(0, 1)),
-                Wait(2.0),
-                repair(),
-
-                # DRIVE OUT AND BACK
-                JumpAndTurn(direction=vec2(-1, 0)),
-                repair(),
-                PolarDrive(duration=1.0, speed=1000, angular_direction=0, boost=True, radius_offset=3000),
-                GroundStop(),
-                repair(),
-                JumpAndTurn(direction=vec2(1, 0)),
-                repair(),
-                PolarDrive(duration=1.0, speed=1000, angular_direction=0, boost=True),
-                GroundStop(),
-                repair(),
-
-                # DRIVE CLOCKWISE AND COUNTER-CLOCKWISE
-                JumpAndTurn(direction=vec2(0, 1)),
-                repair(),
-                PolarDrive(duration=5.0, speed=1000),
-                GroundStop(),
-                repair(),
-                JumpAndTurn(direction=vec2(0, -1)),
-                repair(),
-                PolarDrive(duration=5.0, speed=1000, angular_direction=-1),
-                GroundStop(),
-                repair(),
-                JumpAndTurn(direction=vec2(1, 0)),
-                repair(),
-
-                # BOOST UP, FALL DOWN
-                JumpAndFlyUp(1.5),
-                Wait(1.0),
-                LandSmoothly(duration=1.0, direction=vec2(1, 0)),
-                repair(),
-
-                # BOOST UP, FALL DOWN (HIGHER)
-                JumpAndFlyUp(2.0),
-                Wait(1.0),
-                LandSmoothly(duration=2.0, direction=vec2(1, 0)),
-                repair(),
-
-                # BOOST UP AND THEN DOWN
-                JumpAndFlyUp(2.0),
-                PolarReorient(0.3, forward=vec3(1, 0, 0), up=vec3(0, 0, 1)),
-                PolarReorient(0.5, forward=vec3(0, 0, -1), up=vec3(1, 0, 0)),
-                PolarReorient(0.5, forward=vec3(0, 0, -1), up=vec3(1, 0, 0), boost=True),
-                LandSmoothly(duration=1.0, direction=vec2(1, 0)),
-                repair(),
-
-                # BOOST UP AND THEN DOWN (HIGHER)
-                JumpAndFlyUp(2.5),
-                PolarReorient(0.3, forward=vec3(1, 0, 0), up=vec3(0, 0, 1)),
-                PolarReorient(0.5, forward=vec3(0, 0, -1), up=vec3(1, 0, 0)),
-                PolarReorient(0.8, forward=vec3(0, 0, -1), up=vec3(1, 0, 0), boost=True),
-                LandSmoothly(duration=2.0, direction=vec2(1, 0)),
-                repair(),
-
-                # DRIVE CLOCKWISE AND COUNTER-CLOCKWISE
-                JumpAndTurn(direction=vec2(0, 1)),
-                repair(),
-                PolarDrive(duration=5.0, speed=1000),
-                GroundStop(),
-                repair(),
-                JumpAndTurn(direction=vec2(0, -1)),
-                repair(),
-                PolarDrive(duration=5.0, speed=1000, angular_direction=-1),
-                GroundStop(),
-                repair(),
-                JumpAndTurn(direction=vec2(1, 0)),
-                repair(),
-
-                # FINAL AIRSHOW
-                JumpAndFlyUp(1.5),
-                PolarFlight(duration=3.0),
-                RepairFormation(duration=0.1, include_player=includes_player),
-                PolarFlight(duration=20.0),
-                RepairFormation(duration=0.1, include_player=includes_player),
-                PolarFlight(angular_speed=0.4, duration=pi * 2 / 0.4),
-                PolarFlight(duration=5.0),
-                RepairFormation(duration=0.1, include_player=includes_player),
-                PolarFlight(angular_speed=-0.4, duration=pi * 2 / 0.4),
-                PolarFlight(duration=10.0),
-                RepairFormation(duration=0.1, include_player=includes_player),
-                Wait(0.5),
-                LandSmoothly(duration=3.0),
-            ]
-
-        self.step = CompositeStep(steps=[
-            SetCircle(),
-            TeleportBall(pos=vec3(0, 0, -100)),
-            Wait(1.0),
-            ParallelStep(steps=[
-                DisplayText(text="3"),
-                PartialStep(step=RepairFormation(1.0, True), airshow_ids=range(inner_group_bot_count, 64)),
-            ]),
-            ParallelStep(steps=[
-                DisplayText(text="2"),
-                PartialStep(step=RepairFormation(1.0, True), airshow_ids=range(inner_group_bot_count, 64)),
-            ]),
-            ParallelStep(steps=[
-                DisplayText(text="1"),
-                PartialStep(step=RepairFormation(1.0, True), airshow_ids=range(inner_group_bot_count, 64)),
-            ]),
-            ParallelStep(steps=[
-                PartialStep(
-                    airshow_ids=range(inner_group_bot_count),
-                    step=CompositeStep(steps=airshow(includes_player=False))
-                ),
-                PartialStep(
-                    airshow_ids=range(inner_group_bot_count, 64),
-                    step=EvaluateStep(steps=[Wait(0.5)] + airshow(includes_player=True))
-                ),
-            ]),
-            DisplayScore(duration=10.0),
-            DisplayText(duration=1.0, text="Next round in 3"),
-            DisplayText(duration=1.0, text="Next round in 2"),
-            DisplayText(duration=1.0, text="Next round in 1"),
-        ])
+        self.step = load_show(show_path(self.show), self.geometry)
 
 
+@dataclass
 class LoadGoalExplosion(Step):
+    duration: float = 0.1
+
     def perform(self, context: StepContext, t: float) -> StepResult:
-        return StepResult(finished=t > 0.1, ball_state=BallState(Physics(
+        return StepResult(finished=t > self.duration, ball_state=BallState(Physics(
             location=Vector3(0, 0, 100),
         )), car_states={0: CarState(Physics(
             location=Vector3(0, 0, 17),
@@ -193,6 +38,7 @@ class LoadGoalExplosion(Step):
 
 @dataclass
 class TeleportBall(Step):
+    duration: float = 0.0
     pos: vec3 = vec3(0, 0, 93)
 
     def perform(self, context: StepContext, t: float) -> StepResult:
@@ -208,12 +54,13 @@ class SetCircle(Step):
     duration: float = 0.5
 
     def perform(self, context: StepContext, t: float) -> StepResult:
+        geometry = context.geometry
         car_states = {drone.id: CarState(physics=make_physics(
-            pos=circle_pos(drone.airshow_id),
+            pos=vec3(*geometry.home_position_rows[drone.airshow_id]),
             ori=look_at(
-                dot(rotation(drone.airshow_id), vec3(-1, 0, 0))
+                dot(geometry.rotation_mats[drone.airshow_id], vec3(-1, 0, 0))
             ),
-        )) for drone in context.drones + [context.player]}
+        )) for drone in context.drones + context.players}
 
         for state in car_states.values():
             state.physics.location.z = 17
@@ -229,11 +76,12 @@ class JumpAndTurn(Step):
     direction: vec2 = vec2(1, 0)
 
     def perform(self, context: StepContext, t: float) -> StepResult:
-        for drone in context.drones:
-            if t < 0.2:
+        drones = context.drones
+        if t < 0.2:
+            for drone in drones:
                 drone.controls.jump = True
-            else:
-                reorient(drone, look_at(direction_on_circle(drone.position, vec3(self.direction))))
+        elif drones:
+            reorient_all(drones, look_at_rows(directions_on_circle(positions_of(drones), vec3(self.direction))))
 
         return self.result(t)
 
@@ -244,8 +92,10 @@ class LandSmoothly(Step):
     up_z: float = 1
 
     def perform(self, context: StepContext, t: float) -> StepResult:
-        for drone in context.drones:
-            reorient(drone, look_at(direction_on_circle(drone.position, vec3(self.direction)), vec3(0, 0, self.up_z)))
+        drones = context.drones
+        if drones:
+            reorient_all(drones, look_at_rows(directions_on_circle(positions_of(drones), vec3(self.direction)),
+                                              np.array([0.0, 0.0, self.up_z])))
         return self.result(t)
 
 
@@ -256,12 +106,15 @@ class PolarReorient(Step):
     boost: bool = False
 
     def perform(self, context: StepContext, t: float) -> StepResult:
-        for drone in context.drones:
-            reorient(drone, look_at(
-                direction_on_circle(drone.position, vec3(self.forward)),
-                direction_on_circle(drone.position, vec3(self.up))
+        drones = context.drones
+        if drones:
+            positions = positions_of(drones)
+            reorient_all(drones, look_at_rows(
+                directions_on_circle(positions, self.forward),
+                directions_on_circle(positions, self.up)
             ))
-            drone.controls.boost = self.boost
+            for drone in drones:
+                drone.controls.boost = self.boost
         return self.result(t)
 
 
@@ -301,9 +154,11 @@ class JumpAndFlyUp(Step):
     duration: float = 3.0
 
     def perform(self, context: StepContext, t: float) -> StepResult:
-        for drone in context.drones:
-            if t > 0.2:
-                reorient(drone, look_at(vec3(0, 0, 1), drone.position))
+        drones = context.drones
+        if t > 0.2 and drones:
+            positions = positions_of(drones)
+            reorient_all(drones, look_at_rows(np.broadcast_to(Z, positions.shape), positions))
+        for drone in drones:
             if t < 0.8:
                 drone.controls.jump = True
             else:
@@ -319,14 +174,14 @@ class PolarDrive(Step):
     boost: bool = False
 
     def perform(self, context: StepContext, t: float) -> StepResult:
-        for drone in context.drones:
-            drive(drone, position_on_circle(
-                drone_pos=drone.position,
-                radius=circle_radius(drone.airshow_id) + self.radius_offset,
-                angle_offset=0.2 * self.angular_direction
-            ), self.speed)
-
-            if not self.boost:
+        drones = context.drones
+        if not drones:
+            return self.result(t)
+        radii = context.geometry.radii[[drone.airshow_id for drone in drones]] + self.radius_offset
+        drive_all(drones, positions_on_circle(positions_of(drones), radii, 0.2 * self.angular_direction), self.speed)
+
+        if not self.boost:
+            for drone in drones:
                 drone.controls.boost = False
 
         return self.result(t)
@@ -350,9 +205,10 @@ class PolarFlight(Step):
     angular_speed: float = 0.0
 
     def perform(self, context: StepContext, t: float) -> StepResult:
-        for drone in context.drones:
-            target = circle_pos(drone.airshow_id, angular_offset=t * self.angular_speed)
-            target.z = 1000
-            drone.hover.up = drone.position
-            hover(drone, target=target)
+        drones = context.drones
+        if drones:
+            positions = context.geometry.circle_position_array(angular_offset=t * self.angular_speed)
+            targets = positions[[drone.airshow_id for drone in drones]]
+            targets[:, 2] = 1000
+            hover_all(drones, targets, ups=positions_of(drones))
         return self.result(t)
@@ -1,13 +1,52 @@
+from typing import Optional, Callable, Tuple
+
+import numpy as np
 from rlbot.utils.structures.bot_input_struct import PlayerInput
-from rlbot.utils.structures.game_data_struct import Rotator, Vector3, PlayerInfo, GameTickPacket
+from rlbot.utils.structures.game_data_struct import Rotator, Vector3
 
 from hover import Hover
+from packet_snapshot import PacketSnapshot
 from rlutilities.linear_algebra import vec3, mat3, euler_to_rotation, angle_between, xy, dot
 from rlutilities.mechanics import Aerial, Reorient, Drive
-from rlutilities.simulation import Car, Input
+from rlutilities.simulation import Car
+
+
+def lazy_field(name: str, convert: Callable[[PacketSnapshot, int], object]) -> property:
+    """
+    A field of Car that is converted from the snapshot the first time it's read after an update.
+    The value is written into the underlying Car as well, so sync() before native code reads the car.
+    """
+    native = vars(Car)[name]
+
+    def get(self: "Drone"):
+        if name in self.stale_fields:
+            self.stale_fields.discard(name)
+            native.__set__(self, convert(self.snapshot, self.id))
+        return native.__get__(self)
+
+    def set(self: "Drone", value):
+        if name in self.stale_fields:
+            self.stale_fields.discard(name)
+        native.__set__(self, value)
+
+    return property(get, set)
 
 
 class Drone(Car):
+    LAZY_FIELDS = ("position", "velocity", "orientation", "angular_velocity", "boost", "time",
+                   "on_ground", "jumped", "double_jumped")
+    # fields that haven't been converted from the snapshot yet in this tick
+    stale_fields = frozenset()
+
+    position = lazy_field("position", lambda snapshot, i: vec3(*snapshot.position_rows[i]))
+    velocity = lazy_field("velocity", lambda snapshot, i: vec3(*snapshot.velocity_rows[i]))
+    orientation = lazy_field("orientation", lambda snapshot, i: mat3(*snapshot.orientation_rows[i]))
+    angular_velocity = lazy_field("angular_velocity", lambda snapshot, i: vec3(*snapshot.angular_velocity_rows[i]))
+    boost = lazy_field("boost", lambda snapshot, i: int(snapshot.boost[i]))
+    time = lazy_field("time", lambda snapshot, i: snapshot.time)
+    on_ground = lazy_field("on_ground", lambda snapshot, i: bool(snapshot.on_ground[i]))
+    jumped = lazy_field("jumped", lambda snapshot, i: bool(snapshot.jumped[i]))
+    double_jumped = lazy_field("double_jumped", lambda snapshot, i: bool(snapshot.double_jumped[i]))
 
     def __init__(self, index: int, team: int, airshow_id: int):
         super().__init__()
@@ -18,33 +57,94 @@ class Drone(Car):
         self.aerial = Aerial(self)
         self.hover = Hover(self)
         self.drive = Drive(self)
-
-    def update(self, game_car: PlayerInfo, packet: GameTickPacket):
-        self.position = vector3_to_vec3(game_car.physics.location)
-        self.velocity = vector3_to_vec3(game_car.physics.velocity)
-        self.orientation = rotator_to_mat3(game_car.physics.rotation)
-        self.angular_velocity = vector3_to_vec3(game_car.physics.angular_velocity)
-        self.boost = game_car.boost
-        self.time = packet.game_info.seconds_elapsed
-        self.on_ground = game_car.has_wheel_contact
-        self.jumped = game_car.jumped
-        self.double_jumped = game_car.double_jumped
-
-        self.reorient = Reorient(self)
-        self.controls = Input()
+        self.snapshot: Optional[PacketSnapshot] = None
+        # forward and up as read from the snapshot in this tick
+        self.forward_row: Optional[Tuple[float, float, float]] = None
+        self.up_row: Optional[Tuple[float, float, float]] = None
+
+    def update(self, snapshot: PacketSnapshot, reset_controls: bool = True):
+        """
+        Points the drone at the new packet, the fields are converted when they are first read
+        """
+        self.snapshot = snapshot
+        self.stale_fields = set(self.LAZY_FIELDS)
+        self.forward_row = self.up_row = None
+        if reset_controls:
+            self.reset_controls()
+
+    def sync(self):
+        """
+        Converts the remaining fields, for the native controllers that read the car directly
+        """
+        for name in tuple(self.stale_fields):
+            getattr(self, name)
+
+    # the axes are read straight from the snapshot while the orientation hasn't been needed as a mat3,
+    # once per tick, and each call returns a new vec3 like Car does
+
+    def forward(self) -> vec3:
+        if "orientation" in self.stale_fields:
+            if self.forward_row is None:
+                self.forward_row = tuple(self.snapshot.orientation_rows[self.id][0::3])
+            return vec3(*self.forward_row)
+        return super().forward()
+
+    def up(self) -> vec3:
+        if "orientation" in self.stale_fields:
+            if self.up_row is None:
+                self.up_row = tuple(self.snapshot.orientation_rows[self.id][2::3])
+            return vec3(*self.up_row)
+        return super().up()
+
+    def reset_controls(self):
+        """
+        Clears the controls in place, the controllers are created once per drone and reused
+        """
+        controls = self.controls
+        controls.throttle = 0.0
+        controls.steer = 0.0
+        controls.pitch = 0.0
+        controls.yaw = 0.0
+        controls.roll = 0.0
+        controls.jump = False
+        controls.boost = False
+        controls.handbrake = False
+        self.reorient.finished = False
 
     def get_player_input(self) -> PlayerInput:
         player_input = PlayerInput()
-        player_input.throttle = self.controls.throttle
-        player_input.steer = self.controls.steer
-        player_input.pitch = self.controls.pitch
-        player_input.yaw = self.controls.yaw
-        player_input.roll = self.controls.roll
-        player_input.jump = self.controls.jump
-        player_input.boost = self.controls.boost
-        player_input.handbrake = self.controls.handbrake
+        self.write_player_input(player_input)
         return player_input
 
+    def write_player_input(self, player_input: PlayerInput):
+        controls = self.controls
+        player_input.throttle = controls.throttle
+        player_input.steer = controls.steer
+        player_input.pitch = controls.pitch
+        player_input.yaw = controls.yaw
+        player_input.roll = controls.roll
+        player_input.jump = controls.jump
+        player_input.boost = controls.boost
+        player_input.handbrake = controls.handbrake
+
+    # views into the snapshot arrays, valid until the next packet
+
+    @property
+    def position_view(self) -> np.ndarray:
+        return self.snapshot.positions[self.id]
+
+    @property
+    def velocity_view(self) -> np.ndarray:
+        return self.snapshot.velocities[self.id]
+
+    @property
+    def angular_velocity_view(self) -> np.ndarray:
+        return self.snapshot.angular_velocities[self.id]
+
+    @property
+    def orientation_view(self) -> np.ndarray:
+        return self.snapshot.orientations[self.id]
+
 
 def vector3_to_vec3(v: Vector3) -> vec3:
     return vec3(v.x, v.y, v.z)
@@ -55,6 +155,7 @@ def rotator_to_mat3(r: Rotator) -> mat3:
 
 
 def reorient(drone: Drone, target: mat3):
+    drone.sync()
     drone.reorient.target_orientation = target
     drone.reorient.step(1 / 120)
     drone.controls = drone.reorient.controls
@@ -63,6 +164,7 @@ def reorient(drone: Drone, target: mat3):
 
 
 def drive(drone: Drone, target: vec3, speed: float):
+    drone.sync()
     drone.drive.target = target
     drone.drive.speed = speed
     drone.drive.step(1 / 120)
@@ -70,6 +172,7 @@ def drive(drone: Drone, target: vec3, speed: float):
 
 
 def aerial(drone: Drone, target: vec3, delta_time: float):
+    drone.sync()
     drone.aerial.target_position = target
     drone.aerial.arrival_time = drone.time + delta_time
     drone.aerial.step(1 / 120)
@@ -77,6 +180,7 @@ def aerial(drone: Drone, target: vec3, delta_time: float):
 
 
 def hover(drone: Drone, target: vec3):
+    drone.sync()
     drone.hover.target = target
     drone.hover.step(1 / 120)
     drone.controls = drone.hover.controls
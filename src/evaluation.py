@@ -1,87 +1,117 @@
 from dataclasses import dataclass
+from typing import Optional, List
+
+import numpy as np
 
 from rlbot.utils.game_state_util import CarState
 
-from drone import Drone
-from polar_utils import rotation, polar_mean
-from rlutilities.linear_algebra import vec3, norm, angle_between, dot, normalize, cross, look_at
+from polar_utils import PolarStatistics, state_columns, stack_states, state_errors
+from reference import ReferenceTrajectory
+from rlutilities.linear_algebra import normalize, cross, look_at
 from steps import CompositeStep, StepContext, StepResult, Step, make_physics
+from telemetry import EvaluationRecorder
+
+
+class Scoreboard:
+    """
+    Running score of every human, indexed by the airshow_id of their slot
+    """
+
+    def __init__(self, slot_count: int):
+        self.totals = np.zeros(slot_count)
+        self.frames = np.zeros(slot_count, dtype=int)
 
+    def add(self, airshow_ids: List[int], errors: np.ndarray):
+        # a slot has at most one human, so the ids are unique
+        self.totals[airshow_ids] += 1 - errors / 10
+        self.frames[airshow_ids] += 1
 
-def drone_error(drone: Drone, pos: vec3, vel: vec3, forward: vec3, up: vec3) -> float:
-    error = 0
-    error += norm(pos - drone.position) * 0.03
-    error += norm(vel - drone.velocity) * 0.001
-    error += max(angle_between(forward, drone.forward()), angle_between(up, drone.up())) * 2.0
-    return error
+    def score(self, airshow_id: int) -> int:
+        return int(self.totals[airshow_id] / max(self.frames[airshow_id], 1) * 1000)
+
+    def reset(self):
+        self.totals[:] = 0
+        self.frames[:] = 0
 
 
 @dataclass
 class EvaluateStep(CompositeStep):
     render_rectangle: bool = False
     render_eval_text: bool = True
-    score = 0
-    frame_counter = 0
+    recorder = EvaluationRecorder()
+    # score against a recorded trajectory instead of the drones around the players, see reference.py
+    reference: Optional[ReferenceTrajectory] = None
+    # set to record the trajectory of this run
+    reference_recording: Optional[ReferenceTrajectory] = None
 
     def perform(self, context: StepContext, t: float) -> StepResult:
+        section = self.current_step_index
         result = super().perform(context, t)
-
-        human_rot = rotation(context.player.airshow_id)
-        correct_pos = dot(human_rot, polar_mean(context.drones, lambda drone: drone.position))
-        correct_vel = dot(human_rot, polar_mean(context.drones, lambda drone: drone.velocity))
-        correct_forward = dot(human_rot, polar_mean(context.drones, lambda drone: drone.forward()))
-        correct_up = dot(human_rot, polar_mean(context.drones, lambda drone: drone.up()))
-        correct_left = normalize(cross(correct_up, correct_forward))
-
-        error = drone_error(context.player, correct_pos, correct_vel, correct_forward, correct_up)
-        EvaluateStep.score += (1 - error / 10)
-        EvaluateStep.frame_counter += 1
-
-        renderer = context.interface.renderer
-        renderer.begin_rendering()
-
-        if self.render_rectangle:
-            length, width = 120, 85
-            corners = [
-                correct_pos + correct_left * width / 2 + correct_forward * length / 2,
-                correct_pos - correct_left * width / 2 + correct_forward * length / 2,
-                correct_pos - correct_left * width / 2 - correct_forward * length / 2,
-                correct_pos + correct_left * width / 2 - correct_forward * length / 2,
-            ]
-            renderer.draw_polyline_3d(corners + [corners[0]], renderer.yellow())
-
-        if self.render_eval_text:
-            if error < 0.5:
-                text, color = "Perfect", renderer.lime()
-            elif error < 5.0:
-                text, color = "Okay", renderer.lime()
-            elif error < 10.0:
-                text, color = "Bad", renderer.yellow()
-            else:
-                text, color = "?????", renderer.red()
-
-            renderer.draw_string_3d(context.player.position, 2, 2, text, color)
+        if EvaluateStep.reference_recording is not None and context.peers:
+            EvaluateStep.reference_recording.record(t, PolarStatistics(context.peers, context.geometry).means)
+        players = context.players
+        if not players:
+            return result
+
+        # the correct state is found once, then rotated into the slot of every player,
+        # states and targets are computed straight into the rows of the recorder
+        recorder = EvaluateStep.recorder
+        if recorder.owner is not self:
+            recorder.start(self)
+        airshow_ids = [player.airshow_id for player in players]
+        rows = recorder.begin_frame(t, section, airshow_ids)
+        states = stack_states(players, out=recorder.states[rows])
+        if EvaluateStep.reference is not None:
+            targets = EvaluateStep.reference.targets(t, context.geometry, airshow_ids, out=recorder.targets[rows])
+        else:
+            targets = PolarStatistics(context.peers, context.geometry).targets(players, out=recorder.targets[rows])
+        errors = state_errors(states, targets)
+        if context.scoreboard is not None:
+            context.scoreboard.add(airshow_ids, errors)
+
+        renderer = context.renderer
+        renderer.begin_rendering("evaluation")
+
+        for player, target, error in zip(players, targets, errors.tolist()):
+            if self.render_rectangle:
+                correct_pos, _, _, correct_forward, correct_up = state_columns(target)
+                correct_left = normalize(cross(correct_up, correct_forward))
+                length, width = 120, 85
+                corners = [
+                    correct_pos + correct_left * width / 2 + correct_forward * length / 2,
+                    correct_pos - correct_left * width / 2 + correct_forward * length / 2,
+                    correct_pos - correct_left * width / 2 - correct_forward * length / 2,
+                    correct_pos + correct_left * width / 2 - correct_forward * length / 2,
+                ]
+                renderer.draw_polyline_3d(corners + [corners[0]], renderer.yellow())
+
+            if self.render_eval_text:
+                if error < 0.5:
+                    text, color = "Perfect", renderer.lime()
+                elif error < 5.0:
+                    text, color = "Okay", renderer.lime()
+                elif error < 10.0:
+                    text, color = "Bad", renderer.yellow()
+                else:
+                    text, color = "?????", renderer.red()
+
+                renderer.draw_string_3d(player.position, 2, 2, text, color)
 
         renderer.end_rendering()
         return result
 
-    @classmethod
-    def reset_score(cls):
-        cls.score = 0
-        cls.frame_counter = 0
-
-    @classmethod
-    def get_score(cls) -> int:
-        return int(cls.score / max(cls.frame_counter, 1) * 1000)
-
 
 @dataclass
 class DisplayText(Step):
     text: str = ""
 
     def perform(self, context: StepContext, t: float) -> StepResult:
-        renderer = context.interface.renderer
-        renderer.draw_string_3d(context.player.position, 3, 3, self.text, renderer.yellow())
+        if context.players:
+            renderer = context.renderer
+            renderer.begin_rendering("text")
+            for player in context.players:
+                renderer.draw_string_3d(player.position, 3, 3, self.text, renderer.yellow())
+            renderer.end_rendering()
         return self.result(t)
 
 
@@ -90,8 +120,13 @@ class DisplayScore(Step):
     text: str = ""
 
     def perform(self, context: StepContext, t: float) -> StepResult:
-        renderer = context.interface.renderer
-        renderer.draw_string_3d(context.player.position, 5, 5, f"Score: {EvaluateStep.get_score()}", renderer.yellow())
+        if context.players and context.scoreboard is not None:
+            renderer = context.renderer
+            renderer.begin_rendering("score")
+            for player in context.players:
+                renderer.draw_string_3d(player.position, 5, 5, f"Score: {context.scoreboard.score(player.airshow_id)}",
+                                        renderer.yellow())
+            renderer.end_rendering()
         return self.result(t)
 
 
@@ -101,24 +136,17 @@ class RepairFormation(Step):
     include_player: bool = False
 
     def perform(self, context: StepContext, t: float) -> StepResult:
-        drones_with_player = context.drones + ([context.player] if context.player and self.include_player else [])
+        players = context.players if self.include_player else []
+        drones_with_players = context.drones + players
 
-        mean_pos = polar_mean(context.drones, lambda drone: drone.position)
-        mean_vel = polar_mean(context.drones, lambda drone: drone.velocity)
-        mean_angvel = polar_mean(context.drones, lambda drone: drone.angular_velocity)
-        mean_forward = polar_mean(context.drones, lambda drone: drone.forward())
-        mean_up = polar_mean(context.drones, lambda drone: drone.up())
+        stats = PolarStatistics(context.peers, context.geometry)
+        targets = stats.targets(drones_with_players)
+        errors = stats.errors(drones_with_players, targets)
 
         car_states = {}
-        for drone in drones_with_player:
-            rot = rotation(drone.airshow_id)
-            pos = dot(rot, mean_pos)
-            vel = dot(rot, mean_vel)
-            angvel = dot(rot, mean_angvel)
-            forward = dot(rot, mean_forward)
-            up = dot(rot, mean_up)
-            error = drone_error(drone, pos, vel, forward, up)
-            if error > (5.0 if drone is context.player else 1.0):
+        for i, (drone, target, error) in enumerate(zip(drones_with_players, targets, errors.tolist())):
+            if error > (5.0 if i >= len(context.drones) else 1.0):
+                pos, vel, angvel, forward, up = state_columns(target)
                 car_states[drone.id] = CarState(physics=make_physics(pos, look_at(forward, up), vel, angvel))
 
         return StepResult(finished=t > self.duration, car_states=car_states)
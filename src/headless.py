@@ -0,0 +1,345 @@
+import argparse
+import os
+import time
+from pathlib import Path
+from typing import List, Type, TYPE_CHECKING
+
+import numpy as np
+
+from rlbot.utils.game_state_util import GameState
+from rlbot.utils.structures.bot_input_struct import PlayerInput
+from rlbot.utils.structures.game_data_struct import GameTickPacket, Vector3, PlayerInfo, MAX_PLAYERS
+
+from packet_snapshot import CAR_DTYPE, euler_to_rotation, rotation_to_euler
+
+if TYPE_CHECKING:
+    from step_runner import StepRunner
+
+
+def packet_class(max_cars: int) -> type:
+    """
+    GameTickPacket with room for more than 64 cars, for load testing bigger formations offline
+    """
+    if max_cars <= MAX_PLAYERS:
+        return GameTickPacket
+    fields = [(name, PlayerInfo * max_cars if name == "game_cars" else field_type)
+              for name, field_type in GameTickPacket._fields_]
+    return type(f"GameTickPacket{max_cars}", (GameTickPacket.__bases__[0],), {"_fields_": fields})
+
+
+# columns of the controls array
+THROTTLE, STEER, PITCH, YAW, ROLL, JUMP, BOOST, HANDBRAKE = range(8)
+
+GRAVITY = np.array([0.0, 0.0, -650.0])
+GROUND_Z = 17.0
+MAX_SPEED = 2300.0
+MAX_ANGULAR_SPEED = 5.5
+BOOST_ACCELERATION = 991.667
+THROTTLE_ACCELERATION = 1600.0
+MAX_THROTTLE_SPEED = 1410.0
+BRAKE_ACCELERATION = 3500.0
+COAST_ACCELERATION = 525.0
+AIR_THROTTLE_ACCELERATION = 66.667
+JUMP_SPEED = 291.667
+# aerial torque and damping per unit of input, in roll, pitch and yaw
+AIR_TORQUE = np.array([-400.0, -130.0, 95.0]) / 10.5
+AIR_DAMPING = np.array([-50.0, -30.0, -20.0]) / 10.5
+# turning circle of a car on the ground by speed
+CURVATURE_SPEEDS = np.array([0.0, 500.0, 1000.0, 1500.0, 1750.0, 2300.0])
+CURVATURES = np.array([0.0069, 0.00398, 0.00235, 0.001375, 0.0011, 0.00088])
+
+
+def axis_rotations(axes: np.ndarray) -> np.ndarray:
+    """
+    Rotation matrices for rows of rotation vectors, Rodrigues' formula
+    """
+    angles = np.linalg.norm(axes, axis=1)
+    k = np.divide(axes, angles[:, None], out=np.zeros_like(axes), where=angles[:, None] > 0)
+    cross = np.zeros((len(axes), 3, 3))
+    cross[:, 0, 1], cross[:, 0, 2], cross[:, 1, 2] = -k[:, 2], k[:, 1], -k[:, 0]
+    cross[:, 1, 0], cross[:, 2, 0], cross[:, 2, 1] = k[:, 2], -k[:, 1], k[:, 0]
+    s, c = np.sin(angles)[:, None, None], np.cos(angles)[:, None, None]
+    return np.eye(3) + s * cross + (1 - c) * (cross @ cross)
+
+
+def clamp_norms(vectors: np.ndarray, limit: float) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors * np.minimum(1.0, limit / np.maximum(norms, 1e-9))
+
+
+class HeadlessSimulation:
+    """
+    Stand-in for a running Rocket League match, written into a GameTickPacket after every tick.
+    The cars follow a simplified model of the game in numpy: driving on a flat floor with the turning circle
+    of the game, jumps and double jumps, and aerial control with the game's torque and damping constants.
+    There are no walls, no collisions and no dodges. It doesn't need rlutilities, the drones' controllers
+    still do, and this tree only ships rlutilities builds for Windows.
+    """
+
+    def __init__(self, bot_count: int = 63, humans: int = 1, dt: float = 1 / 120):
+        self.dt = dt
+        self.time = 0.0
+        self.bot_count = bot_count
+        # the humans come after the bots and never touch their controls
+        self.human_indices = range(bot_count, bot_count + humans)
+        n = self.car_count = bot_count + humans
+
+        self.positions = np.zeros((n, 3))
+        self.positions[:, 0] = np.arange(n) * 150 - 5000
+        self.positions[:, 1] = -3000
+        self.positions[:, 2] = GROUND_Z
+        self.velocities = np.zeros((n, 3))
+        self.angular_velocities = np.zeros((n, 3))
+        self.orientations = np.tile(np.eye(3), (n, 1, 1))
+        self.on_ground = np.ones(n, dtype=bool)
+        self.jumped = np.zeros(n, dtype=bool)
+        self.double_jumped = np.zeros(n, dtype=bool)
+        self.boost = np.full(n, 100, dtype=np.int32)  # unlimited boost mutator
+        self.controls = np.zeros((n, 8))
+        self.held_jump = np.zeros(n, dtype=bool)
+        self.ball_location = np.array([0.0, 0.0, 93.0])
+
+        self.packet = packet_class(n)()
+        for i in range(n):
+            self.packet.game_cars[i].is_bot = i not in self.human_indices
+            self.packet.game_cars[i].name = f"Human {i - bot_count}" if i in self.human_indices else str(i)
+        self.packet_cars = np.frombuffer(self.packet.game_cars, dtype=CAR_DTYPE, count=n)
+        self.write_packet()
+
+    def tick(self) -> GameTickPacket:
+        self.step(self.dt)
+        self.time += self.dt
+        self.write_packet()
+        return self.packet
+
+    def step(self, dt: float):
+        controls = self.controls
+        forward, up = self.orientations[:, :, 0], self.orientations[:, :, 2]
+        boosting = controls[:, BOOST] > 0
+        jump_pressed = (controls[:, JUMP] > 0) & ~self.held_jump
+        self.held_jump = controls[:, JUMP] > 0
+        ground, air = self.on_ground, ~self.on_ground
+
+        # on the ground: speed along the nose, the turning circle of the game, no sliding
+        speed = np.einsum("ij,ij->i", self.velocities, forward)
+        throttle = controls[:, THROTTLE]
+        acceleration = np.where(np.abs(speed) < MAX_THROTTLE_SPEED, throttle * THROTTLE_ACCELERATION, 0.0)
+        acceleration = np.where(throttle * speed < 0, np.sign(throttle) * BRAKE_ACCELERATION, acceleration)
+        acceleration = np.where(throttle == 0, -np.sign(speed) * np.minimum(COAST_ACCELERATION, np.abs(speed) / dt),
+                                acceleration)
+        acceleration += boosting * BOOST_ACCELERATION
+        ground_speed = np.clip(speed + acceleration * dt, -MAX_SPEED, MAX_SPEED)
+        yaw_rate = controls[:, STEER] * np.interp(np.abs(ground_speed), CURVATURE_SPEEDS, CURVATURES) * ground_speed
+        ground_angular_velocities = np.zeros_like(self.angular_velocities)
+        ground_angular_velocities[:, 2] = yaw_rate
+
+        # in the air: torque and damping in the car's frame, boost and a little throttle along the nose
+        local = np.einsum("nji,nj->ni", self.orientations, self.angular_velocities)
+        inputs = controls[:, [ROLL, PITCH, YAW]]
+        damping = AIR_DAMPING * local * np.stack([np.ones(len(local)), 1 - np.abs(inputs[:, 1]),
+                                                  1 - np.abs(inputs[:, 2])], axis=1)
+        angular_acceleration = np.einsum("nij,nj->ni", self.orientations, AIR_TORQUE * inputs + damping)
+        air_angular_velocities = clamp_norms(self.angular_velocities + angular_acceleration * dt, MAX_ANGULAR_SPEED)
+        air_velocities = self.velocities + (GRAVITY + forward * (boosting * BOOST_ACCELERATION +
+                                                                 controls[:, THROTTLE] * AIR_THROTTLE_ACCELERATION)[:, None]) * dt
+
+        self.velocities = np.where(ground[:, None], forward * ground_speed[:, None], air_velocities)
+        self.angular_velocities = np.where(ground[:, None], ground_angular_velocities, air_angular_velocities)
+
+        # jumps push along the roof, the second one only once in the air
+        first_jump = jump_pressed & ground
+        second_jump = jump_pressed & air & self.jumped & ~self.double_jumped
+        self.velocities += up * (JUMP_SPEED * (first_jump | second_jump))[:, None]
+        self.on_ground = ground & ~first_jump
+        self.jumped |= first_jump
+        self.double_jumped |= second_jump
+
+        self.velocities = clamp_norms(self.velocities, MAX_SPEED)
+        self.positions = self.positions + self.velocities * dt
+        self.orientations = axis_rotations(self.angular_velocities * dt) @ self.orientations
+
+        # landing puts the wheels back on the floor, facing the same way
+        landed = ~self.on_ground & (self.positions[:, 2] <= GROUND_Z) & (self.velocities[:, 2] <= 0)
+        if landed.any():
+            self.settle_on_ground(landed)
+
+    def settle_on_ground(self, cars: np.ndarray):
+        yaws = rotation_to_euler(self.orientations[cars])[:, 1]
+        self.orientations[cars] = euler_to_rotation(np.stack([np.zeros_like(yaws), yaws, np.zeros_like(yaws)], axis=1))
+        self.positions[cars, 2] = GROUND_Z
+        self.velocities[cars, 2] = 0.0
+        self.angular_velocities[cars] = 0.0
+        self.on_ground[cars] = True
+        self.jumped[cars] = False
+        self.double_jumped[cars] = False
+
+    def write_packet(self):
+        packet = self.packet
+        packet.num_cars = self.car_count
+        packet.game_info.seconds_elapsed = self.time
+        packet.game_info.is_round_active = True
+        packet.game_info.is_unlimited_time = True
+        packet.game_ball.physics.location = Vector3(*self.ball_location.tolist())
+
+        cars = self.packet_cars
+        cars["location"] = self.positions
+        cars["rotation"] = rotation_to_euler(self.orientations)
+        cars["velocity"] = self.velocities
+        cars["angular_velocity"] = self.angular_velocities
+        cars["has_wheel_contact"] = self.on_ground
+        cars["jumped"] = self.jumped
+        cars["double_jumped"] = self.double_jumped
+        cars["boost"] = self.boost
+        cars["team"] = 0
+
+    def set_controls(self, index: int, player_input: PlayerInput):
+        self.controls[index] = (player_input.throttle, player_input.steer, player_input.pitch, player_input.yaw,
+                                player_input.roll, player_input.jump, player_input.boost, player_input.handbrake)
+
+    def set_game_state(self, game_state: GameState):
+        for index, car_state in (game_state.cars or {}).items():
+            physics = car_state.physics
+            if physics is not None:
+                _merge(self.positions[index], physics.location)
+                _merge(self.velocities[index], physics.velocity)
+                _merge(self.angular_velocities[index], physics.angular_velocity)
+                if physics.rotation is not None:
+                    pyr = rotation_to_euler(self.orientations[index:index + 1])
+                    rotation = physics.rotation
+                    _merge(pyr[0], (rotation.pitch, rotation.yaw, rotation.roll))
+                    self.orientations[index] = euler_to_rotation(pyr)[0]
+                self.on_ground[index] = self.positions[index, 2] <= GROUND_Z + 1.0
+            if car_state.boost_amount is not None:
+                self.boost[index] = int(car_state.boost_amount)
+            if car_state.jumped is not None:
+                self.jumped[index] = car_state.jumped
+            if car_state.double_jumped is not None:
+                self.double_jumped[index] = car_state.double_jumped
+
+        ball_state = game_state.ball
+        if ball_state is not None and ball_state.physics is not None:
+            _merge(self.ball_location, ball_state.physics.location)
+
+
+def _merge(current: np.ndarray, desired):
+    """
+    Writes the components of a desired vector that are set into current
+    """
+    if desired is None:
+        return
+    values = desired if isinstance(desired, tuple) else (desired.x, desired.y, desired.z)
+    for i, value in enumerate(values):
+        if value is not None:
+            current[i] = value
+
+
+class HeadlessInterface:
+    """
+    Implements the parts of rlbot's GameInterface that the StepRunner uses, on top of a HeadlessSimulation
+    """
+
+    def __init__(self, simulation: HeadlessSimulation):
+        # rendering needs rlutilities, the simulation alone doesn't
+        from rendering import NullRenderer
+
+        self.simulation = simulation
+        self.renderer = NullRenderer()
+        self.game_state_calls = 0
+        self.player_input_calls = 0
+
+    def set_game_state(self, game_state: GameState):
+        self.game_state_calls += 1
+        self.simulation.set_game_state(game_state)
+
+    def update_player_input(self, player_input: PlayerInput, index: int):
+        self.player_input_calls += 1
+        self.simulation.set_controls(index, player_input)
+
+    def update_player_inputs(self, player_inputs, indices: List[int]):
+        self.player_input_calls += 1
+        for index in indices:
+            self.simulation.set_controls(index, player_inputs[index])
+
+
+class HeadlessGame:
+    """
+    Tick driver with the same packet API as BaseScript, minus the waiting
+    """
+
+    def __init__(self, bot_count: int = 63, humans: int = 1):
+        self.simulation = HeadlessSimulation(bot_count, humans)
+        self.game_interface = HeadlessInterface(self.simulation)
+
+    def wait_game_tick_packet(self) -> GameTickPacket:
+        return self.simulation.tick()
+
+    def run(self, runner_class: Type["StepRunner"], seconds: float, on_tick=None,
+            one_round: bool = False) -> "StepRunner":
+        """
+        Runs the choreography for the given amount of simulated time, or until the first round ends, and returns the runner
+        """
+        packet = self.wait_game_tick_packet()
+        runner = runner_class(self.game_interface, packet)
+        end_time = self.simulation.time + seconds
+
+        while self.simulation.time < end_time:
+            controls = runner.get_outputs(packet)
+            controls.submit(self.game_interface)
+            if runner.profiler:
+                runner.profiler.end_tick()
+            if on_tick is not None:
+                on_tick(runner, packet)
+            if one_round and runner.step is None:
+                break
+            packet = self.wait_game_tick_packet()
+
+        return runner
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the choreography without Rocket League")
+    parser.add_argument("--seconds", type=float,
+                        help="simulated time to run (default: 60, or the whole show with --record-reference)")
+    parser.add_argument("--bots", type=int, help="default: one per bot slot of the formation")
+    parser.add_argument("--humans", type=int,
+                        help="idle humans to score, the formation gets a slot for each (default: AIRSHOW_HUMANS or 1)")
+    parser.add_argument("--no-human", action="store_true", help="same as --humans 0")
+    parser.add_argument("--record", help="directory to record the run into, see recording.py")
+    parser.add_argument("--record-reference", metavar="FILE",
+                        help="record the reference trajectory for AIRSHOW_REFERENCE, like AIRSHOW_RECORD_REFERENCE "
+                             "in a game, implies --no-human")
+    args = parser.parse_args()
+
+    if args.record_reference:
+        os.environ["AIRSHOW_RECORD_REFERENCE"] = args.record_reference
+
+    import choreography
+    from recording import PacketRecorder
+    from polar_utils import formation_geometry
+    from show_format import load_show, show_path
+
+    if args.humans is not None:
+        choreography.Choreography.geometry = formation_geometry(humans=args.humans)
+    geometry = choreography.Choreography.geometry
+    bot_count = len(geometry.bot_slots) if args.bots is None else args.bots
+    game = HeadlessGame(bot_count, 0 if args.no_human or args.record_reference else len(geometry.human_slots))
+    if args.seconds is None:
+        # the whole round, which ends a little after the nominal duration of the show
+        args.seconds = load_show(show_path(choreography.Choreography.show), geometry).total_duration() + 10.0 \
+            if args.record_reference else 60.0
+    on_tick = None
+    if args.record:
+        recorder = PacketRecorder(Path(args.record), len(game.simulation.packet.game_cars), args.seconds + 1.0)
+        on_tick = lambda runner, packet: recorder.record(packet, runner.inputs, runner.state_setter)
+
+    start, start_time = time.perf_counter(), game.simulation.time
+    runner = game.run(choreography.Choreography, args.seconds, on_tick, one_round=bool(args.record_reference))
+    elapsed = time.perf_counter() - start
+    simulated = game.simulation.time - start_time
+    print(f"Simulated {simulated:.1f}s in {elapsed:.1f}s ({simulated / elapsed:.1f}x real time)")
+    for player in runner.players:
+        print(f"Score of car {player.id} in slot {player.airshow_id}: {runner.scoreboard.score(player.airshow_id)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+from typing import List, Iterator, Optional
+
+import numpy as np
+from rlbot.utils.structures.bot_input_struct import PlayerInput
+
+
+class InputBuffer:
+    """
+    Contiguous, preallocated PlayerInput structs indexed by car index.
+    Drones write their controls straight into it and it is sent to the game in one pass.
+    With a buffer, the structs live in that memory, e.g. shared with a worker process.
+    """
+
+    def __init__(self, max_cars: int, indices: List[int] = (), buffer=None):
+        if buffer is None:
+            self.inputs = (PlayerInput * max_cars)()
+        else:
+            self.inputs = (PlayerInput * max_cars).from_buffer(buffer)
+        # numpy view of the same memory, for copying many cars at once
+        self.array = np.ctypeslib.as_array(self.inputs)
+        # ctypes creates a new wrapper object on every item access, so keep one per car
+        self.views: List[PlayerInput] = [self.inputs[i] for i in range(max_cars)]
+        self.indices: List[int] = list(indices)
+
+    def __getitem__(self, index: int) -> PlayerInput:
+        return self.views[index]
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.indices)
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def submit(self, interface, differ: Optional["InputDiffer"] = None):
+        """
+        Sends the inputs of all cars in self.indices, or only the ones that changed when there is a differ.
+        rlbot's GameInterface only takes one car per call, so it gets a tight loop over the preallocated structs.
+        Interfaces that have update_player_inputs get the whole buffer at once.
+        """
+        indices = self.indices if differ is None else differ.select(self)
+        if not indices:
+            return
+
+        update_player_inputs = getattr(interface, "update_player_inputs", None)
+        if update_player_inputs is not None:
+            update_player_inputs(self.inputs, indices)
+            return
+
+        update_player_input = interface.update_player_input
+        views = self.views
+        for index in indices:
+            update_player_input(views[index], index)
+
+
+class InputDiffer:
+    """
+    Remembers the last inputs sent for each car, so that cars holding the same controls aren't sent again.
+    The game keeps the last input of a car, but every car is still sent once per keep_alive ticks,
+    in case something was lost on the way.
+    """
+
+    def __init__(self, max_cars: int, keep_alive: int = 60):
+        self.keep_alive = keep_alive
+        self.last = np.zeros(max_cars, dtype=np.dtype(PlayerInput))
+        self.last_sent_tick = np.full(max_cars, -keep_alive - 1)
+        self.tick = 0
+
+        self.submitted = 0
+        self.skipped = 0
+
+    def select(self, inputs: InputBuffer) -> List[int]:
+        """
+        The indices of inputs that have to be sent this tick, they are assumed to be sent after this
+        """
+        self.tick += 1
+        indices = np.array(inputs.indices, dtype=int)
+        array = inputs.array[indices]
+        send = (array != self.last[indices]) | (self.tick - self.last_sent_tick[indices] >= self.keep_alive)
+        indices = indices[send]
+        self.last[indices] = array[send]
+        self.last_sent_tick[indices] = self.tick
+
+        self.submitted += len(indices)
+        self.skipped += len(send) - len(indices)
+        return indices.tolist()
+
+    def report(self) -> str:
+        total = max(self.submitted + self.skipped, 1)
+        return f"{self.submitted} inputs sent, {self.skipped} unchanged ones skipped ({self.skipped / total:.0%})"
+
+    def reset(self):
+        self.submitted = 0
+        self.skipped = 0
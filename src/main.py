@@ -1,8 +1,7 @@
-import importlib
+import os
 import time
 import traceback
 from pathlib import Path
-from types import ModuleType
 
 from rlbot.agents.base_script import BaseScript
 from rlbot.matchconfig.loadout_config import LoadoutConfig
@@ -10,6 +9,10 @@ from rlbot.matchconfig.match_config import PlayerConfig, MatchConfig, MutatorCon
 from rlbot.setup_manager import SetupManager
 
 import choreography
+from input_transport import InputDiffer
+from pipeline import TickPipeline
+from recording import PacketRecorder
+from reloader import ModuleWatcher, reload_modules
 
 
 def human_config():
@@ -35,7 +38,8 @@ def create_player_config(name: str):
 
 def build_match_config():
     match_config = MatchConfig()
-    match_config.player_configs = [create_player_config(str(i)) for i in range(63)] + [human_config()]
+    bot_count = len(choreography.Choreography.geometry.bot_slots)
+    match_config.player_configs = [create_player_config(str(i)) for i in range(bot_count)] + [human_config()]
     match_config.game_mode = 'Soccer'
     match_config.game_map = 'Mannfield'
     match_config.existing_match_behavior = 'Continue And Spawn'
@@ -47,15 +51,6 @@ def build_match_config():
     return match_config
 
 
-def rreload(module):
-    """Recursively reload modules."""
-    importlib.reload(module)
-    for attribute_name in dir(module):
-        attribute = getattr(module, attribute_name)
-        if type(attribute) is ModuleType:
-            rreload(attribute)
-
-
 class AirshowSimulator(BaseScript):
     def __init__(self):
         super().__init__("Airshow Simulator")
@@ -75,23 +70,43 @@ class AirshowSimulator(BaseScript):
         self.setup_manager.start_match()
 
         packet = self.wait_game_tick_packet()
-        self.choreo = choreography.Choreography(self.game_interface, packet)
 
-        self.choreo_file = Path(__file__).parent / "choreography.py"
-        self.last_mtime = self.choreo_file.lstat().st_mtime
+        # AIRSHOW_INPUT_KEEP_ALIVE=<ticks>: how often controls that didn't change are sent anyway, 0 sends all
+        self.input_differ = InputDiffer(len(packet.game_cars), int(os.environ.get("AIRSHOW_INPUT_KEEP_ALIVE", 60)))
+
+        # AIRSHOW_SERIAL=1 does all game calls in the tick loop, like it used to
+        self.pipeline = None
+        self.runner_interface = self.game_interface
+        if not os.environ.get("AIRSHOW_SERIAL"):
+            self.pipeline = TickPipeline(self.game_interface, len(packet.game_cars), self.input_differ)
+            self.runner_interface = self.pipeline.runner_interface
+        self.choreo = choreography.Choreography(self.runner_interface, packet)
+
+        # AIRSHOW_RECORD=<directory>: record the show for replaying it with recording.py
+        self.recorder = None
+        if os.environ.get("AIRSHOW_RECORD"):
+            self.recorder = PacketRecorder(Path(os.environ["AIRSHOW_RECORD"]) / time.strftime("show-%Y%m%d-%H%M%S"),
+                                           len(packet.game_cars))
+
+        self.source_dir = Path(__file__).parent
+        self.watcher = ModuleWatcher(self.source_dir)
+        self.watcher.start()
 
     def run(self):
         while True:
             packet = self.wait_game_tick_packet()
 
-            # reload choreo if modified
-            mtime = self.choreo_file.lstat().st_mtime
-            if mtime > self.last_mtime:
+            # reload modified modules and continue the show where it was
+            changed = self.watcher.pop_changed()
+            if changed:
                 try:
-                    rreload(choreography)
-                    self.choreo = choreography.Choreography(self.game_interface, packet)
-                    print(f"[{mtime}] Reloaded choreo")
-                    self.last_mtime = mtime
+                    state = self.choreo.save_state()
+                    reloaded = reload_modules(changed, self.source_dir)
+                    choreo = choreography.Choreography(self.runner_interface, packet)
+                    choreo.restore_state(state)
+                    self.choreo.close()
+                    self.choreo = choreo
+                    print(f"[{time.strftime('%X')}] Reloaded {', '.join(reloaded)} at t={state['t']:.1f}")
 
                 except Exception as ex:
                     print()
@@ -111,8 +126,20 @@ class AirshowSimulator(BaseScript):
                 time.sleep(1.0)
                 continue
 
-            for index in controls:
-                self.game_interface.update_player_input(controls[index], index)
+            if self.recorder:
+                self.recorder.record(packet, controls, self.choreo.state_setter)
+
+            if self.pipeline:
+                self.pipeline.push(controls)
+            else:
+                controls.submit(self.game_interface, self.input_differ)
+
+            if self.choreo.profiler:
+                self.choreo.profiler.end_tick()
+
+            if self.choreo.step is None:
+                print(f"Input differ: {self.input_differ.report()}")
+                self.input_differ.reset()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,158 @@
+import ctypes
+from typing import List
+
+import numpy as np
+from rlbot.utils.structures.game_data_struct import GameTickPacket, PlayerInfo, Physics, MAX_PLAYERS
+
+
+def _field_offset(*path) -> int:
+    offset = 0
+    struct = PlayerInfo
+    for name in path:
+        descriptor = getattr(struct, name)
+        offset += descriptor.offset
+        struct = dict(struct._fields_)[name]
+    return offset
+
+
+# numpy view of the PlayerInfo ctypes struct, so all cars can be read in one go without touching ctypes per field
+CAR_DTYPE = np.dtype({
+    "names": ["location", "rotation", "velocity", "angular_velocity",
+              "has_wheel_contact", "is_bot", "jumped", "double_jumped", "team", "boost"],
+    "formats": [(np.float32, 3), (np.float32, 3), (np.float32, 3), (np.float32, 3),
+                np.bool_, np.bool_, np.bool_, np.bool_, np.uint8, np.int32],
+    "offsets": [_field_offset("physics") + Physics.location.offset,
+                _field_offset("physics") + Physics.rotation.offset,
+                _field_offset("physics") + Physics.velocity.offset,
+                _field_offset("physics") + Physics.angular_velocity.offset,
+                _field_offset("has_wheel_contact"), _field_offset("is_bot"),
+                _field_offset("jumped"), _field_offset("double_jumped"),
+                _field_offset("team"), _field_offset("boost")],
+    "itemsize": ctypes.sizeof(PlayerInfo),
+})
+
+
+def _layout(max_cars: int):
+    return [
+        ("header", (2,), np.float64),  # time, num_cars
+        ("positions", (max_cars, 3), np.float64),
+        ("velocities", (max_cars, 3), np.float64),
+        ("angular_velocities", (max_cars, 3), np.float64),
+        ("rotators", (max_cars, 3), np.float64),  # pitch, yaw, roll
+        ("orientations", (max_cars, 3, 3), np.float64),
+        ("ball", (3, 3), np.float64),  # location, velocity, angular velocity
+        ("boost", (max_cars,), np.int32),
+        ("on_ground", (max_cars,), np.bool_),
+        ("jumped", (max_cars,), np.bool_),
+        ("double_jumped", (max_cars,), np.bool_),
+        ("is_bot", (max_cars,), np.bool_),
+        ("team", (max_cars,), np.uint8),
+    ]
+
+
+class PacketSnapshot:
+    """
+    Structure-of-arrays copy of all cars in a GameTickPacket, unpacked once per tick.
+    Row i always belongs to packet.game_cars[i].
+    The arrays can live in a shared buffer, other processes then attach to it and call load() after every update.
+    """
+
+    def __init__(self, max_cars: int = MAX_PLAYERS, buffer=None):
+        self.max_cars = max_cars
+        self.num_cars = 0
+        self.time = 0.0
+
+        if buffer is None:
+            buffer = bytearray(PacketSnapshot.nbytes(max_cars))
+        offset = 0
+        for name, shape, dtype in _layout(max_cars):
+            array = np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset)
+            setattr(self, name, array)
+            offset += array.nbytes
+
+        # plain python lists of the same data, so that building vec3/mat3 from a row doesn't go through numpy scalars
+        self.position_rows = []
+        self.velocity_rows = []
+        self.angular_velocity_rows = []
+        self.orientation_rows = []
+
+    @staticmethod
+    def nbytes(max_cars: int) -> int:
+        return sum(int(np.prod(shape)) * np.dtype(dtype).itemsize for _, shape, dtype in _layout(max_cars))
+
+    def update(self, packet: GameTickPacket):
+        n = packet.num_cars
+        cars = np.frombuffer(packet.game_cars, dtype=CAR_DTYPE, count=n)
+
+        self.num_cars = n
+        self.time = packet.game_info.seconds_elapsed
+        self.header[:] = self.time, n
+        self.positions[:n] = cars["location"]
+        self.velocities[:n] = cars["velocity"]
+        self.angular_velocities[:n] = cars["angular_velocity"]
+        self.rotators[:n] = cars["rotation"]
+        euler_to_rotation(self.rotators[:n], out=self.orientations[:n])
+        self.boost[:n] = cars["boost"]
+        self.on_ground[:n] = cars["has_wheel_contact"]
+        self.jumped[:n] = cars["jumped"]
+        self.double_jumped[:n] = cars["double_jumped"]
+        self.is_bot[:n] = cars["is_bot"]
+        self.team[:n] = cars["team"]
+
+        ball = packet.game_ball.physics
+        self.ball[:] = [(v.x, v.y, v.z) for v in (ball.location, ball.velocity, ball.angular_velocity)]
+        self.update_rows()
+
+    def load(self):
+        """
+        Picks up an update that another process made to the shared arrays
+        """
+        self.time = float(self.header[0])
+        self.num_cars = int(self.header[1])
+        self.update_rows()
+
+    def update_rows(self):
+        n = self.num_cars
+        self.position_rows = self.positions[:n].tolist()
+        self.velocity_rows = self.velocities[:n].tolist()
+        self.angular_velocity_rows = self.angular_velocities[:n].tolist()
+        self.orientation_rows = self.orientations[:n].reshape(n, 9).tolist()
+
+    def human_indices(self) -> List[int]:
+        return np.flatnonzero(~self.is_bot[:self.num_cars]).tolist()
+
+
+def euler_to_rotation(pyr: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+    """
+    Vectorized version of rlutilities' euler_to_rotation, columns are forward, left and up
+    """
+    cp, cy, cr = np.cos(pyr[:, 0]), np.cos(pyr[:, 1]), np.cos(pyr[:, 2])
+    sp, sy, sr = np.sin(pyr[:, 0]), np.sin(pyr[:, 1]), np.sin(pyr[:, 2])
+
+    if out is None:
+        out = np.empty((len(pyr), 3, 3))
+
+    out[:, 0, 0] = cp * cy
+    out[:, 1, 0] = cp * sy
+    out[:, 2, 0] = sp
+
+    out[:, 0, 1] = cy * sp * sr - cr * sy
+    out[:, 1, 1] = sy * sp * sr + cr * cy
+    out[:, 2, 1] = -cp * sr
+
+    out[:, 0, 2] = -cr * cy * sp - sr * sy
+    out[:, 1, 2] = -cr * sy * sp + sr * cy
+    out[:, 2, 2] = cp * cr
+    return out
+
+
+def rotation_to_euler(orientations: np.ndarray) -> np.ndarray:
+    """
+    Inverse of euler_to_rotation, rows of pitch, yaw and roll
+    """
+    forward, left, up = orientations[:, :, 0], orientations[:, :, 1], orientations[:, :, 2]
+    return np.stack([
+        np.arctan2(forward[:, 2], np.hypot(forward[:, 0], forward[:, 1])),
+        np.arctan2(forward[:, 1], forward[:, 0]),
+        np.arctan2(-left[:, 2], up[:, 2]),
+    ], axis=1)
@@ -0,0 +1,118 @@
+import queue
+import threading
+import traceback
+from typing import Optional
+
+from rlbot.utils.game_state_util import GameState
+
+from input_transport import InputBuffer, InputDiffer
+from rendering import RecordingRenderer, replay
+
+
+class LatestSlot:
+    """
+    Hands values from one thread to another when only the newest one matters
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.value = None
+
+    def put(self, value):
+        """
+        Returns the value that was replaced without being taken, if any
+        """
+        with self.condition:
+            replaced, self.value = self.value, value
+            self.condition.notify()
+        return replaced
+
+    def take(self):
+        with self.condition:
+            while self.value is None:
+                self.condition.wait()
+            value, self.value = self.value, None
+        return value
+
+
+class PipelinedInterface:
+    """
+    What the StepRunner sees instead of the GameInterface: draw calls are recorded and states are queued,
+    the actual calls happen on the TickPipeline threads
+    """
+
+    def __init__(self, pipeline: "TickPipeline", renderer: RecordingRenderer):
+        self.pipeline = pipeline
+        self.renderer = renderer
+
+    def set_game_state(self, game_state: GameState):
+        self.pipeline.states.put(game_state)
+
+
+class TickPipeline:
+    """
+    Sends the inputs, renders and sets game states on their own threads, so that the tick loop only waits
+    for the packet and does the math. Inputs and render groups that are overtaken by newer ones are dropped,
+    game states are sent in order.
+    """
+
+    def __init__(self, interface, max_cars: int, differ: Optional[InputDiffer] = None):
+        self.interface = interface
+        self.differ = differ
+        # kept apart from runner_interface.renderer, which the profiler may wrap
+        self.recorder = RecordingRenderer()
+        self.runner_interface = PipelinedInterface(self, self.recorder)
+        self.states: "queue.Queue[GameState]" = queue.Queue()
+        self.inputs = LatestSlot()
+        self.render_ready = threading.Event()
+
+        # one buffer being filled, one waiting and one being sent
+        self.free_buffers: "queue.Queue[InputBuffer]" = queue.Queue()
+        for _ in range(3):
+            self.free_buffers.put(InputBuffer(max_cars))
+
+        self.dropped_inputs = 0
+        for target, name in [(self.submit_inputs, "InputSubmitter"),
+                             (self.flush_renders, "RenderFlusher"),
+                             (self.set_states, "StateSetter")]:
+            threading.Thread(target=self.loop, args=(target, name), name=name, daemon=True).start()
+
+    def push(self, controls: InputBuffer):
+        """
+        Hands this tick's controls and render groups to the threads, controls is free to change after this
+        """
+        buffer = self.free_buffers.get()
+        buffer.array[:] = controls.array
+        buffer.indices = controls.indices
+
+        replaced: Optional[InputBuffer] = self.inputs.put(buffer)
+        if replaced is not None:
+            self.dropped_inputs += 1
+            self.free_buffers.put(replaced)
+        self.render_ready.set()
+
+    def submit_inputs(self):
+        buffer = self.inputs.take()
+        try:
+            buffer.submit(self.interface, self.differ)
+        finally:
+            self.free_buffers.put(buffer)
+
+    def flush_renders(self):
+        self.render_ready.wait()
+        self.render_ready.clear()
+        replay(self.recorder.take(), self.interface.renderer)
+
+    def set_states(self):
+        self.interface.set_game_state(self.states.get())
+
+    @staticmethod
+    def loop(target, name: str):
+        while True:
+            try:
+                target()
+            except Exception as ex:
+                print()
+                print(f"-----------------{name.upper()} EXCEPTION-----------------")
+                print(ex)
+                print(traceback.format_exc())
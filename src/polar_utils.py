@@ -1,44 +1,244 @@
+import os
+from dataclasses import dataclass
 from math import pi
-from typing import List, Callable
+from typing import List, Dict, Tuple, Sequence
+
+import numpy as np
 
 from drone import Drone
-from rlutilities.linear_algebra import mat3, axis_to_rotation, vec3, dot, inv, normalize, cross
+from rlutilities.linear_algebra import mat3, axis_to_rotation, vec3
+
+
+@dataclass(frozen=True)
+class Ring:
+    count: int
+    radius: float
+    # how fast the ring turns for a given angular offset, rings at whole multiples of each other line up again
+    angular_rate: float = 1.0
+    # how far behind the leading ring this one performs the show, so it can follow what the others do
+    delay: float = 0.0
+
+
+class FormationGeometry:
+    """
+    Lookup tables for a layout of concentric rings, indexed by airshow_id.
+    The slots are numbered ring by ring, and every slot except the humans' is given to a bot in packet order.
+    """
+
+    def __init__(self, rings: Sequence[Ring], human_slots: Sequence[int] = ()):
+        self.rings = list(rings)
+        starts = np.cumsum([0] + [ring.count for ring in self.rings])
+        self.slot_count = int(starts[-1])
+        self.ring_ids = [range(int(starts[i]), int(starts[i + 1])) for i in range(len(self.rings))]
+        self.ring_of_slot = np.repeat(np.arange(len(self.rings)), [ring.count for ring in self.rings])
+
+        for slot in human_slots:
+            if not 0 <= slot < self.slot_count:
+                raise ValueError(f"human slot {slot} is outside of the {self.slot_count} slots")
+        if len(set(human_slots)) != len(human_slots):
+            raise ValueError(f"human slots {human_slots} contain duplicates")
+        # humans get these slots in packet order
+        self.human_slots: List[int] = list(human_slots)
+        self.human_rings: List[int] = sorted({int(self.ring_of_slot[slot]) for slot in human_slots})
+        self.bot_slots = [slot for slot in range(self.slot_count) if slot not in self.human_slots]
+
+        def per_slot(values) -> np.ndarray:
+            return np.array(values, dtype=float)[self.ring_of_slot]
+
+        ids = np.arange(self.slot_count)
+        self.angles = (ids - starts[self.ring_of_slot]) / per_slot([ring.count for ring in self.rings]) * pi * 2
+        self.angular_rates = per_slot([ring.angular_rate for ring in self.rings])
+        self.radii = per_slot([ring.radius for ring in self.rings])
+        self.delays = per_slot([ring.delay for ring in self.rings])
+        self.rotations = z_rotations(self.angles)
+        self.inverse_rotations = self.rotations.transpose(0, 2, 1).copy()
+        self.home_positions = self.rotations[:, :, 0] * self.radii[:, None]
+
+        # the same tables as rlutilities types, for code that works with vec3/mat3
+        self.radius_list: List[float] = self.radii.tolist()
+        self.rotation_mats = [mat3(*r) for r in self.rotations.reshape(-1, 9).tolist()]
+        self.inverse_rotation_mats = [mat3(*r) for r in self.inverse_rotations.reshape(-1, 9).tolist()]
+        self.home_position_rows: List[List[float]] = self.home_positions.tolist()
+
+        self._offset_positions_key = None
+        self._offset_positions: List[List[float]] = self.home_position_rows
+        self._offset_position_array: np.ndarray = self.home_positions
+
+    @property
+    def human_ring_ids(self) -> List[int]:
+        return [airshow_id for ring in self.human_rings for airshow_id in self.ring_ids[ring]]
+
+    def assign_slots(self, bot_count: int) -> List[int]:
+        """
+        airshow_ids for the bots in packet order
+        """
+        if bot_count > len(self.bot_slots):
+            raise ValueError(f"the formation has {len(self.bot_slots)} slots for bots, but there are {bot_count} bots")
+        return self.bot_slots[:bot_count]
+
+    def rotation(self, airshow_id: int, angular_offset=0.0) -> mat3:
+        if angular_offset == 0.0:
+            return self.rotation_mats[airshow_id]
+        angle = self.angles[airshow_id] + self.angular_rates[airshow_id] * angular_offset
+        return axis_to_rotation(vec3(0, 0, angle))
+
+    def circle_pos(self, airshow_id: int, radius_offset=0.0, angular_offset=0.0) -> vec3:
+        x, y, z = self.circle_positions(angular_offset)[airshow_id]
+        scale = 1.0 + radius_offset / self.radius_list[airshow_id]
+        return vec3(x * scale, y * scale, z)
+
+    def circle_positions(self, angular_offset=0.0) -> List[List[float]]:
+        """
+        Positions of all slots with the given angular offset. Every drone in a step asks for the same offset
+        in the same tick, so the last result is kept and the trig runs once per tick instead of once per drone.
+        """
+        self.update_offset_positions(angular_offset)
+        return self._offset_positions
+
+    def circle_position_array(self, angular_offset=0.0) -> np.ndarray:
+        """
+        Same as circle_positions, as a (slot_count, 3) array
+        """
+        self.update_offset_positions(angular_offset)
+        return self._offset_position_array
+
+    def update_offset_positions(self, angular_offset: float):
+        if angular_offset != self._offset_positions_key:
+            if angular_offset == 0.0:
+                positions = self.home_positions
+                self._offset_positions = self.home_position_rows
+            else:
+                angles = self.angles + self.angular_rates * angular_offset
+                positions = np.zeros((self.slot_count, 3))
+                positions[:, 0] = np.cos(angles) * self.radii
+                positions[:, 1] = np.sin(angles) * self.radii
+                self._offset_positions = positions.tolist()
+            self._offset_position_array = positions
+            self._offset_positions_key = angular_offset
+
+
+def z_rotations(angles: np.ndarray) -> np.ndarray:
+    c, s = np.cos(angles), np.sin(angles)
+    rotations = np.zeros((len(angles), 3, 3))
+    rotations[:, 0, 0] = c
+    rotations[:, 0, 1] = -s
+    rotations[:, 1, 0] = s
+    rotations[:, 1, 1] = c
+    rotations[:, 2, 2] = 1
+    return rotations
+
+
+# kept across importlib.reload, so a hot reload of the choreography doesn't rebuild the tables
+_geometry_cache: Dict[Tuple, FormationGeometry] = globals().get("_geometry_cache", {})
+
+
+def ring_formation(rings: Sequence[Ring], human_slots: Sequence[int] = ()) -> FormationGeometry:
+    # plain tuples, Ring is a new class after a reload and its instances wouldn't match the old keys
+    key = (tuple((ring.count, ring.radius, ring.angular_rate, ring.delay) for ring in rings), tuple(human_slots))
+    if key not in _geometry_cache:
+        _geometry_cache[key] = FormationGeometry(rings, human_slots)
+    return _geometry_cache[key]
+
+
+def spread_slots(ids: Sequence[int], count: int, first: int) -> List[int]:
+    """
+    count of the ids spread evenly around a ring, starting at first
+    """
+    if count > len(ids):
+        raise ValueError(f"{count} slots don't fit into a ring of {len(ids)}")
+    start = list(ids).index(first)
+    return [ids[(start + i * len(ids) // count) % len(ids)] for i in range(count)]
+
+
+def formation_geometry(inner_count: int = 20, slot_count: int = 64,
+                       inner_radius: float = 1200, outer_radius: float = 2000,
+                       humans: int = 1, first_human_slot: int = 40, follow_delay: float = 0.5) -> FormationGeometry:
+    """
+    The original two circles: the inner one leads and turns twice as fast,
+    the humans follow in the outer one, spread evenly around it
+    """
+    human_slots = spread_slots(range(inner_count, slot_count), humans, first_human_slot) if humans else []
+    return ring_formation([
+        Ring(inner_count, inner_radius, angular_rate=2.0),
+        Ring(slot_count - inner_count, outer_radius, delay=follow_delay),
+    ], human_slots)
+
+
+POSITION, VELOCITY, ANGULAR_VELOCITY, FORWARD, UP = range(5)
+
+
+def stack_states(drones: List[Drone], out: np.ndarray = None) -> np.ndarray:
+    """
+    Position, velocity, angular velocity, forward and up of each drone as columns of a (n, 3, 5) array
+    """
+    states = np.empty((len(drones), 3, 5)) if out is None else out
+    if not drones:
+        return states
+    snapshot = drones[0].snapshot
+    rows = [drone.id for drone in drones]
+    states[:, :, POSITION] = snapshot.positions[rows]
+    states[:, :, VELOCITY] = snapshot.velocities[rows]
+    states[:, :, ANGULAR_VELOCITY] = snapshot.angular_velocities[rows]
+    orientations = snapshot.orientations[rows]
+    states[:, :, FORWARD] = orientations[:, :, 0]
+    states[:, :, UP] = orientations[:, :, 2]
+    return states
+
 
+class PolarStatistics:
+    """
+    Polar-frame means of all state fields over a group of drones, computed in a single batched pass.
+    Used to find where each drone should be if it perfectly followed the rest of the formation.
+    """
 
-def rotation(drone_id: int, angular_offset=0.0) -> mat3:
-    if drone_id < inner_group_bot_count:
-        angle = drone_id / inner_group_bot_count * pi * 2
-        angle += angular_offset * 2
-    else:
-        angle = (drone_id - inner_group_bot_count) / (64 - inner_group_bot_count) * pi * 2
-        angle += angular_offset
-    return axis_to_rotation(vec3(0, 0, angle))
+    def __init__(self, drones: List[Drone], geometry: FormationGeometry):
+        self.geometry = geometry
+        airshow_ids = [drone.airshow_id for drone in drones]
+        polar_states = geometry.inverse_rotations[airshow_ids] @ stack_states(drones)
+        self.means: np.ndarray = polar_states.mean(axis=0)
 
+    def targets(self, drones: List[Drone], out: np.ndarray = None) -> np.ndarray:
+        """
+        The mean state rotated into the slot of each drone, shape (n, 3, 5)
+        """
+        return np.matmul(self.geometry.rotations[[drone.airshow_id for drone in drones]], self.means, out=out)
 
-def circle_radius(drone_id: int) -> float:
-    return 1200 if drone_id < inner_group_bot_count else 2000
+    def errors(self, drones: List[Drone], targets: np.ndarray) -> np.ndarray:
+        return state_errors(stack_states(drones), targets)
 
 
-def circle_pos(drone_id: int, radius_offset=0.0, angular_offset=0.0) -> vec3:
-    rot = rotation(drone_id, angular_offset)
-    return dot(rot, vec3(1, 0, 0)) * (circle_radius(drone_id) + radius_offset)
+def state_errors(states: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """
+    Error of each state against its target over (n, 3, 5) state arrays, the sum of its components
+    """
+    return state_error_components(states, targets).sum(axis=1)
 
 
-def polar_mean(drones: List[Drone], value: Callable[[Drone], vec3]) -> vec3:
-    sum = vec3()
-    for drone in drones:
-        sum += dot(inv(rotation(drone.airshow_id)), value(drone))
-    return sum / len(drones)
+def state_error_components(states: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """
+    Position, velocity and orientation terms of the error, shape (n, 3)
+    """
+    components = np.empty((len(states), 3))
+    components[:, 0] = np.linalg.norm(targets[:, :, POSITION] - states[:, :, POSITION], axis=1) * 0.03
+    components[:, 1] = np.linalg.norm(targets[:, :, VELOCITY] - states[:, :, VELOCITY], axis=1) * 0.001
+    components[:, 2] = np.maximum(
+        angles_between(targets[:, :, FORWARD], states[:, :, FORWARD]),
+        angles_between(targets[:, :, UP], states[:, :, UP]),
+    ) * 2.0
+    return components
 
 
-def direction_on_circle(drone_pos: vec3, direction: vec3) -> vec3:
-    towards_center = normalize(drone_pos) * -1
-    tangent = normalize(cross(towards_center, vec3(0, 0, 1)))
-    return direction.x * towards_center + direction.y * tangent + direction.z * vec3(0, 0, 1)
+def angles_between(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    cos = np.einsum("ij,ij->i", a, b) / np.maximum(np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1), 1e-9)
+    return np.arccos(np.clip(cos, -1.0, 1.0))
 
 
-def position_on_circle(drone_pos: vec3, radius: float, angle_offset: float) -> vec3:
-    return dot(axis_to_rotation(vec3(0, 0, angle_offset)), normalize(drone_pos)) * radius
+def state_columns(state: np.ndarray) -> List[vec3]:
+    """
+    Splits a (3, 5) state into position, velocity, angular velocity, forward and up vec3s
+    """
+    return [vec3(*column) for column in state.T.tolist()]
 
 
-inner_group_bot_count = 20
+# AIRSHOW_HUMANS=<n>: how many humans are scored, each gets a slot in the outer circle
+geometry = formation_geometry(humans=int(os.environ.get("AIRSHOW_HUMANS", 1)))
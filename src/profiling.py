@@ -0,0 +1,235 @@
+import csv
+import json
+import os
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Type
+
+from steps import Step
+
+TICK_BUDGET = 1 / 120
+
+
+class Timing:
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.self_total = 0.0
+        self.max = 0.0
+
+    def add(self, elapsed: float, self_elapsed: float):
+        self.calls += 1
+        self.total += elapsed
+        self.self_total += self_elapsed
+        self.max = max(self.max, elapsed)
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "total_ms": self.total * 1000,
+            "self_ms": self.self_total * 1000,
+            "mean_ms": self.total / max(self.calls, 1) * 1000,
+            "max_ms": self.max * 1000,
+        }
+
+
+class TickProfiler:
+    """
+    Opt-in instrumentation of Step.perform, game state setting, rendering and input submission.
+    Enabled by setting the AIRSHOW_PROFILE environment variable to the directory where round reports go.
+    """
+
+    overlay_interval = 60
+    overlay_lines = 8
+
+    def __init__(self, output_dir: Path, budget: float = TICK_BUDGET):
+        self.output_dir = output_dir
+        self.budget = budget
+        self.patched: List[Type[Step]] = []
+        self.reset()
+
+        # time spent in nested calls, so that self time of a step doesn't include its children
+        self.child_time: List[float] = []
+        self.active_steps: List[Step] = []
+        self.tick_start: Optional[float] = None
+        self.overlay: List[str] = []
+        self.overlay_changed = False
+
+    @staticmethod
+    def from_environment() -> Optional["TickProfiler"]:
+        output_dir = os.environ.get("AIRSHOW_PROFILE")
+        return TickProfiler(Path(output_dir)) if output_dir else None
+
+    def reset(self):
+        self.classes: Dict[str, Timing] = defaultdict(Timing)
+        self.instances: Dict[int, Timing] = defaultdict(Timing)
+        self.instance_names: Dict[int, str] = {}
+        self.sections: Dict[str, Timing] = defaultdict(Timing)
+        self.ticks = Timing()
+        self.ticks_over_budget = 0
+        self.round_start = time.time()
+
+    def install(self, interface):
+        """
+        Wraps perform of every Step subclass and the slow GameInterface calls
+        """
+        self.install_steps()
+
+        # a hot reload installs a new profiler on the same interface
+        for name, section in [("set_game_state", "set_game_state"),
+                              ("update_player_input", "update_player_input"),
+                              ("update_player_inputs", "update_player_input")]:
+            if hasattr(interface, name):
+                function = getattr(interface, name)
+                setattr(interface, name, self.timed_section(section, getattr(function, "__wrapped__", function)))
+        renderer = interface.renderer
+        interface.renderer = TimedRenderer(self, getattr(renderer, "renderer", renderer))
+
+    def install_steps(self):
+        for cls in all_subclasses(Step):
+            if "perform" in cls.__dict__:
+                original = getattr(cls.__dict__["perform"], "__wrapped__", cls.__dict__["perform"])
+                cls.perform = self.timed_perform(original)
+                self.patched.append(cls)
+
+    def uninstall(self):
+        for cls in self.patched:
+            cls.perform = cls.__dict__["perform"].__wrapped__
+        self.patched.clear()
+
+    def timed_perform(self, original):
+        def perform(step, context, t):
+            # EvaluateStep calls CompositeStep.perform through super(), which is the same step
+            if self.active_steps and self.active_steps[-1] is step:
+                return original(step, context, t)
+
+            self.active_steps.append(step)
+            self.child_time.append(0.0)
+            start = time.perf_counter()
+            try:
+                return original(step, context, t)
+            finally:
+                elapsed = time.perf_counter() - start
+                self_elapsed = elapsed - self.child_time.pop()
+                self.active_steps.pop()
+                if self.child_time:
+                    self.child_time[-1] += elapsed
+                self.record_step(step, elapsed, self_elapsed)
+
+        perform.__wrapped__ = original
+        return perform
+
+    def timed_section(self, name: str, function):
+        def timed(*args, **kwargs):
+            self.child_time.append(0.0)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                self_elapsed = elapsed - self.child_time.pop()
+                if self.child_time:
+                    self.child_time[-1] += elapsed
+                self.sections[name].add(elapsed, self_elapsed)
+
+        timed.__wrapped__ = function
+        return timed
+
+    def record_step(self, step: Step, elapsed: float, self_elapsed: float):
+        self.classes[type(step).__name__].add(elapsed, self_elapsed)
+        key = id(step)
+        if key not in self.instance_names:
+            count = sum(1 for name in self.instance_names.values() if name.startswith(type(step).__name__ + "#"))
+            self.instance_names[key] = f"{type(step).__name__}#{count}"
+        self.instances[key].add(elapsed, self_elapsed)
+
+    def begin_tick(self):
+        self.tick_start = time.perf_counter()
+
+    def end_tick(self):
+        if self.tick_start is None:
+            return
+        elapsed = time.perf_counter() - self.tick_start
+        self.tick_start = None
+        self.ticks.add(elapsed, elapsed)
+        if elapsed > self.budget:
+            self.ticks_over_budget += 1
+        if self.ticks.calls % self.overlay_interval == 0:
+            self.overlay = self.overlay_text()
+            self.overlay_changed = True
+
+    def overlay_text(self) -> List[str]:
+        ticks = max(self.ticks.calls, 1)
+        lines = [f"tick {self.ticks.total / ticks * 1000:.2f} ms avg, {self.ticks.max * 1000:.2f} ms max, "
+                 f"{self.ticks_over_budget}/{self.ticks.calls} over budget"]
+        timings = [(name, timing) for name, timing in {**self.sections, **self.classes}.items()]
+        timings.sort(key=lambda item: item[1].self_total, reverse=True)
+        for name, timing in timings[:self.overlay_lines]:
+            lines.append(f"{name}: {timing.self_total / ticks * 1000:.3f} ms/tick")
+        return lines
+
+    def render_overlay(self, renderer):
+        # render groups stay on screen until replaced, so only send it when the numbers change
+        if not self.overlay_changed:
+            return
+        self.overlay_changed = False
+        renderer.begin_rendering("profiler")
+        for i, line in enumerate(self.overlay):
+            renderer.draw_string_2d(20, 200 + i * 20, 1, 1, line, renderer.white())
+        renderer.end_rendering()
+
+    def report(self) -> dict:
+        return {
+            "duration_s": time.time() - self.round_start,
+            "ticks": self.ticks.as_dict(),
+            "ticks_over_budget": self.ticks_over_budget,
+            "budget_ms": self.budget * 1000,
+            "sections": {name: timing.as_dict() for name, timing in self.sections.items()},
+            "step_classes": {name: timing.as_dict() for name, timing in self.classes.items()},
+            "step_instances": {self.instance_names[key]: timing.as_dict() for key, timing in self.instances.items()},
+        }
+
+    def end_round(self):
+        """
+        Writes the report of the finished round as json and csv and starts a new one
+        """
+        report = self.report()
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        name = time.strftime("round-%Y%m%d-%H%M%S", time.localtime(self.round_start))
+
+        with open(self.output_dir / f"{name}.json", "w") as file:
+            json.dump(report, file, indent=2)
+
+        with open(self.output_dir / f"{name}.csv", "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["kind", "name", "calls", "total_ms", "self_ms", "mean_ms", "max_ms"])
+            for kind in ["sections", "step_classes", "step_instances"]:
+                for name, timing in report[kind].items():
+                    writer.writerow([kind, name] + list(timing.values()))
+
+        self.reset()
+
+
+class TimedRenderer:
+    """
+    Counts the time of every renderer call towards the "render" section
+    """
+
+    def __init__(self, profiler: TickProfiler, renderer):
+        self.profiler = profiler
+        self.renderer = renderer
+
+    def __getattr__(self, name):
+        attribute = getattr(self.renderer, name)
+        if callable(attribute):
+            attribute = self.profiler.timed_section("render", attribute)
+            setattr(self, name, attribute)
+        return attribute
+
+
+def all_subclasses(cls: type) -> List[type]:
+    subclasses = [cls]
+    for subclass in cls.__subclasses__():
+        subclasses += all_subclasses(subclass)
+    return subclasses
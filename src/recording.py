@@ -0,0 +1,228 @@
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import Iterator, Type
+
+import numpy as np
+from numpy.lib.recfunctions import structured_to_unstructured
+from rlbot.utils.structures.bot_input_struct import PlayerInput
+from rlbot.utils.structures.game_data_struct import GameTickPacket, Vector3, Rotator
+
+from headless import packet_class
+from input_transport import InputBuffer
+from packet_snapshot import CAR_DTYPE
+from rendering import NullRenderer
+from state_setting import StateSetScheduler, COLUMNS
+from step_runner import StepRunner
+
+# the fields of CAR_DTYPE without the rest of PlayerInfo in between
+RECORDED_CAR_DTYPE = np.dtype([(name, CAR_DTYPE.fields[name][0]) for name in CAR_DTYPE.names])
+CONTROLS_DTYPE = np.dtype(PlayerInput)
+STATE_DTYPE = np.dtype([("tick", np.int32), ("row", np.int32), ("values", np.float32, COLUMNS)])
+
+
+def tick_dtype(max_cars: int) -> np.dtype:
+    return np.dtype([
+        ("seconds_elapsed", np.float64),
+        ("num_cars", np.int32),
+        ("ball", np.float32, (4, 3)),  # location, rotation, velocity, angular velocity
+        ("cars", RECORDED_CAR_DTYPE, max_cars),
+        ("controls", CONTROLS_DTYPE, max_cars),
+    ])
+
+
+class PacketRecorder:
+    """
+    Writes the cars and ball of every packet, the controls the runner sent and the game states it set
+    into memory-mapped files in a directory. The counts are updated after every tick,
+    so a recording is readable up to the last tick even if the process dies.
+    """
+
+    def __init__(self, directory: Path, max_cars: int, seconds: float = 600.0):
+        directory.mkdir(parents=True, exist_ok=True)
+        self.directory = directory
+        self.max_cars = max_cars
+        capacity = int(seconds * 120)
+        with open(directory / "meta.json", "w") as file:
+            json.dump({"max_cars": max_cars, "capacity": capacity, "created": time.time()}, file)
+
+        self.ticks = np.memmap(directory / "ticks.bin", dtype=tick_dtype(max_cars), mode="w+", shape=(capacity,))
+        self.states = np.memmap(directory / "states.bin", dtype=STATE_DTYPE, mode="w+", shape=(capacity * 4,))
+        self.counts = np.memmap(directory / "counts.bin", dtype=np.int64, mode="w+", shape=(2,))
+        self.tick_count = 0
+        self.state_count = 0
+        self.full = False
+
+    def record(self, packet: GameTickPacket, controls: InputBuffer, state_setter: StateSetScheduler):
+        i = self.tick_count
+        rows = state_setter.sent_rows
+        if i >= len(self.ticks) or self.state_count + len(rows) > len(self.states):
+            if not self.full:
+                print(f"Recording {self.directory} is full, stopped recording")
+                self.full = True
+            return
+
+        n = packet.num_cars
+        tick = self.ticks[i]
+        tick["seconds_elapsed"] = packet.game_info.seconds_elapsed
+        tick["num_cars"] = n
+        tick["cars"][:n] = np.frombuffer(packet.game_cars, dtype=CAR_DTYPE, count=n)
+        tick["controls"][:] = controls.array[:self.max_cars]
+        physics = packet.game_ball.physics
+        tick["ball"] = [(physics.location.x, physics.location.y, physics.location.z),
+                        (physics.rotation.pitch, physics.rotation.yaw, physics.rotation.roll),
+                        (physics.velocity.x, physics.velocity.y, physics.velocity.z),
+                        (physics.angular_velocity.x, physics.angular_velocity.y, physics.angular_velocity.z)]
+
+        if len(rows):
+            states = self.states[self.state_count:self.state_count + len(rows)]
+            states["tick"] = i
+            states["row"] = rows
+            states["values"] = state_setter.sent_values
+            self.state_count += len(rows)
+
+        self.tick_count += 1
+        self.counts[:] = self.tick_count, self.state_count
+
+    def close(self):
+        self.ticks.flush()
+        self.states.flush()
+        self.counts.flush()
+
+
+class PacketReplay:
+    """
+    Reads a recording back as GameTickPackets
+    """
+
+    def __init__(self, directory: Path):
+        with open(directory / "meta.json") as file:
+            meta = json.load(file)
+        self.max_cars = meta["max_cars"]
+        tick_count, state_count = np.fromfile(directory / "counts.bin", dtype=np.int64)
+        self.ticks = np.memmap(directory / "ticks.bin", dtype=tick_dtype(self.max_cars), mode="r",
+                               shape=(meta["capacity"],))[:tick_count]
+        self.states = np.memmap(directory / "states.bin", dtype=STATE_DTYPE, mode="r",
+                                shape=(meta["capacity"] * 4,))[:state_count]
+        # where the states of each tick start and end
+        self.state_bounds = np.searchsorted(self.states["tick"], np.arange(tick_count + 1))
+
+    def __len__(self) -> int:
+        return len(self.ticks)
+
+    def packets(self) -> Iterator[GameTickPacket]:
+        """
+        Yields the same packet object for every tick, like the game does
+        """
+        packet = packet_class(self.max_cars)()
+        cars = np.frombuffer(packet.game_cars, dtype=CAR_DTYPE, count=self.max_cars)
+        packet.game_info.is_round_active = True
+        for i in range(self.max_cars):
+            packet.game_cars[i].name = str(i)
+
+        for tick in self.ticks:
+            n = int(tick["num_cars"])
+            packet.num_cars = n
+            packet.game_info.seconds_elapsed = float(tick["seconds_elapsed"])
+            cars[:n] = tick["cars"][:n]
+            location, rotation, velocity, angular_velocity = tick["ball"].tolist()
+            physics = packet.game_ball.physics
+            physics.location = Vector3(*location)
+            physics.rotation = Rotator(*rotation)
+            physics.velocity = Vector3(*velocity)
+            physics.angular_velocity = Vector3(*angular_velocity)
+            yield packet
+
+    def controls(self, i: int) -> np.ndarray:
+        return structured_to_unstructured(self.ticks[i]["controls"], dtype=np.float32)
+
+    def state_sets(self, i: int) -> np.ndarray:
+        return self.states[self.state_bounds[i]:self.state_bounds[i + 1]]
+
+
+class ReplayInterface:
+    """
+    Takes the place of the GameInterface during a replay, everything the runner sends is checked or dropped
+    """
+
+    def __init__(self):
+        self.renderer = NullRenderer()
+
+    def set_game_state(self, game_state):
+        pass
+
+
+def replay(directory: Path, runner_class: Type[StepRunner], on_tick=None) -> dict:
+    """
+    Feeds a recording through a runner as fast as possible and compares its outputs to the recorded ones
+    """
+    recording = PacketReplay(directory)
+    interface = ReplayInterface()
+    runner = None
+    control_mismatches = 0
+    state_mismatches = 0
+    max_control_difference = 0.0
+    first_mismatch = None
+    latencies = []
+
+    for i, packet in enumerate(recording.packets()):
+        if runner is None:
+            runner = runner_class(interface, packet)
+
+        start = time.perf_counter()
+        controls = runner.get_outputs(packet)
+        latencies.append((time.perf_counter() - start) * 1000)
+        if on_tick is not None:
+            on_tick(runner, packet)
+
+        ids = np.array(controls.indices, dtype=int)
+        difference = np.abs(structured_to_unstructured(controls.array[ids], dtype=np.float32) -
+                            recording.controls(i)[ids]).max(initial=0.0)
+        max_control_difference = max(max_control_difference, float(difference))
+
+        recorded = recording.state_sets(i)
+        rows = runner.state_setter.sent_rows
+        values = runner.state_setter.sent_values[:len(rows)].astype(np.float32)
+        same_states = len(recorded) == len(rows) and np.array_equal(recorded["row"], rows) and \
+            np.allclose(recorded["values"], values, atol=1e-3, equal_nan=True)
+
+        if difference > 1e-6 or not same_states:
+            control_mismatches += difference > 1e-6
+            state_mismatches += not same_states
+            if first_mismatch is None:
+                first_mismatch = i
+
+    latencies = np.array(latencies or [0.0])
+    return {
+        "ticks": len(recording),
+        "control_mismatches": int(control_mismatches),
+        "state_mismatches": int(state_mismatches),
+        "max_control_difference": max_control_difference,
+        "first_mismatch": first_mismatch,
+        "first_mismatch_t": float(recording.ticks[first_mismatch]["seconds_elapsed"] -
+                                  recording.ticks[0]["seconds_elapsed"]) if first_mismatch is not None else None,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "max_ms": float(latencies.max()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recording made with AIRSHOW_RECORD=<directory> "
+                                                 "and compare the outputs against it")
+    parser.add_argument("recording", help="directory of the recording")
+    args = parser.parse_args()
+
+    import choreography
+
+    start = time.perf_counter()
+    report = replay(Path(args.recording), choreography.Choreography)
+    elapsed = time.perf_counter() - start
+    for key, value in report.items():
+        print(f"{key:<24}{value}")
+    print(f"Replayed {report['ticks']} ticks in {elapsed:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
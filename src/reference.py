@@ -0,0 +1,71 @@
+from pathlib import Path
+
+import numpy as np
+
+from polar_utils import FormationGeometry
+
+
+class ReferenceTrajectory:
+    """
+    The polar-frame mean state of the formation on a fixed time grid, recorded from a run without a human.
+    Scoring the player against it needs only a lookup per frame, and the same performance always gets
+    the same score, no matter how well the drones around the player happen to be doing.
+    """
+    rate = 120
+
+    def __init__(self, means: np.ndarray, filled: np.ndarray = None):
+        self.means = means
+        self.filled = np.ones(len(means), dtype=bool) if filled is None else filled
+
+    @staticmethod
+    def empty(seconds: float) -> "ReferenceTrajectory":
+        count = int(seconds * ReferenceTrajectory.rate) + 2
+        return ReferenceTrajectory(np.zeros((count, 3, 5)), np.zeros(count, dtype=bool))
+
+    def record(self, t: float, means: np.ndarray):
+        i = int(round(t * self.rate))
+        if 0 <= i < len(self.means):
+            self.means[i] = means
+            self.filled[i] = True
+
+    def duration(self) -> float:
+        return (len(self.means) - 1) / self.rate
+
+    def lookup(self, t: float) -> np.ndarray:
+        """
+        Mean state at time t of the evaluation, shape (3, 5), linearly interpolated between grid points
+        """
+        x = min(max(t * self.rate, 0.0), len(self.means) - 1.0)
+        i = min(int(x), len(self.means) - 2)
+        w = x - i
+        return self.means[i] * (1.0 - w) + self.means[i + 1] * w
+
+    def targets(self, t: float, geometry: FormationGeometry, airshow_ids, out: np.ndarray = None) -> np.ndarray:
+        """
+        The reference state rotated into the given slots, shape (n, 3, 5) like PolarStatistics.targets
+        """
+        return np.matmul(geometry.rotations[airshow_ids], self.lookup(t), out=out)
+
+    def trimmed(self) -> "ReferenceTrajectory":
+        """
+        Cut after the last recorded frame, with ticks that fell between grid points filled from the previous one
+        """
+        recorded = np.flatnonzero(self.filled)
+        if not len(recorded):
+            raise ValueError("no frames were recorded")
+        end = recorded[-1] + 1
+        sources = np.maximum.accumulate(np.where(self.filled[:end], np.arange(end), recorded[0]))
+        return ReferenceTrajectory(self.means[sources].copy())
+
+    def save(self, path: Path):
+        trajectory = self.trimmed()
+        np.savez_compressed(path, rate=self.rate, means=trajectory.means)
+
+    @staticmethod
+    def load(path: Path) -> "ReferenceTrajectory":
+        data = np.load(path)
+        if int(data["rate"]) != ReferenceTrajectory.rate:
+            raise ValueError(f"{path} was recorded at {int(data['rate'])} Hz, expected {ReferenceTrajectory.rate}")
+        if len(data["means"]) < 2:
+            raise ValueError(f"{path} is too short")
+        return ReferenceTrajectory(data["means"])
@@ -0,0 +1,100 @@
+import ast
+import importlib
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Set, List
+
+
+class ModuleWatcher(threading.Thread):
+    """
+    Polls the modifications times of the local modules in a background thread,
+    so the tick loop only has to look at a set instead of doing syscalls
+    """
+
+    def __init__(self, directory: Path, interval: float = 0.5):
+        super().__init__(daemon=True, name="ModuleWatcher")
+        self.directory = directory
+        self.interval = interval
+        self.mtimes = self.scan()
+        self.changed: Set[str] = set()
+        self.lock = threading.Lock()
+
+    def scan(self) -> Dict[str, float]:
+        return {path.stem: path.stat().st_mtime for path in self.directory.glob("*.py")}
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                mtimes = self.scan()
+            except OSError:
+                continue  # a file was replaced while we were looking, try again next time
+
+            changed = {name for name, mtime in mtimes.items() if self.mtimes.get(name) != mtime}
+            if changed:
+                with self.lock:
+                    self.changed |= changed
+                self.mtimes = mtimes
+
+    def pop_changed(self) -> Set[str]:
+        if not self.changed:
+            return set()
+        with self.lock:
+            changed, self.changed = self.changed, set()
+        return changed
+
+
+def local_imports(path: Path, local_modules: Set[str]) -> Set[str]:
+    imports = set()
+    for node in ast.walk(ast.parse(path.read_text(), str(path))):
+        if isinstance(node, ast.Import):
+            imports |= {alias.name.split(".")[0] for alias in node.names}
+        elif isinstance(node, ast.ImportFrom) and node.module and node.level == 0:
+            imports.add(node.module.split(".")[0])
+    return imports & local_modules
+
+
+def reload_order(changed: Set[str], directory: Path) -> List[str]:
+    """
+    The changed modules plus every local module that imports them, directly or not,
+    with dependencies before the modules that use them
+    """
+    local_modules = {path.stem for path in directory.glob("*.py")}
+    dependencies = {name: local_imports(directory / f"{name}.py", local_modules) for name in local_modules}
+
+    affected = set(changed) & local_modules
+    while True:
+        dependents = {name for name, imports in dependencies.items() if imports & affected} - affected
+        if not dependents:
+            break
+        affected |= dependents
+
+    order = []
+    visited = set()
+
+    def visit(name: str):
+        if name in visited:
+            return
+        visited.add(name)
+        for dependency in sorted(dependencies[name] & affected):
+            visit(dependency)
+        order.append(name)
+
+    for name in sorted(affected):
+        visit(name)
+    return order
+
+
+def reload_modules(changed: Set[str], directory: Path) -> List[str]:
+    """
+    Reloads the changed modules and their dependents, returns the names of the reloaded modules
+    """
+    reloaded = []
+    for name in reload_order(changed, directory):
+        module = sys.modules.get(name)
+        if module is not None and name != "__main__":
+            importlib.reload(module)
+            reloaded.append(name)
+    return reloaded
@@ -0,0 +1,164 @@
+import threading
+from functools import partial
+from typing import Dict, Optional
+
+from rlutilities.linear_algebra import vec3, norm
+
+
+class NullRenderer:
+    """
+    Renderer that accepts every draw call and throws it away
+    """
+
+    def begin_rendering(self, group_id: str = "default"):
+        pass
+
+    def end_rendering(self):
+        pass
+
+    def clear_screen(self, group_id: str = "default"):
+        pass
+
+    def __getattr__(self, name):
+        # draw_* calls and colors
+        return _ignore
+
+
+def _ignore(*args, **kwargs):
+    return None
+
+
+COLOR_METHODS = {"create_color", "black", "white", "gray", "grey", "blue", "red", "green", "lime", "yellow",
+                 "orange", "cyan", "pink", "purple", "teal", "team_color"}
+
+
+class RecordedColor:
+    def __init__(self, name: str, *args):
+        self.name = name
+        self.args = args
+
+    def resolve(self, renderer):
+        return getattr(renderer, self.name)(*self.args)
+
+
+class RecordingRenderer:
+    """
+    Records render groups so that another thread can replay them on the real renderer.
+    Colors are recorded by name, the real ones belong to the flatbuffer builder of the renderer.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.groups: Dict[str, Optional[list]] = {}  # None clears the group
+        self.group_id = None
+        self.calls: Optional[list] = None
+
+    def begin_rendering(self, group_id: str = "default"):
+        self.group_id = group_id
+        self.calls = []
+
+    def end_rendering(self):
+        if self.calls is None:
+            return
+        with self.lock:
+            self.groups[self.group_id] = self.calls
+        self.calls = None
+
+    def clear_screen(self, group_id: str = "default"):
+        with self.lock:
+            self.groups[group_id] = None
+
+    def __getattr__(self, name):
+        if name in COLOR_METHODS:
+            return partial(RecordedColor, name)
+        if not name.startswith("draw_"):
+            raise AttributeError(name)
+
+        def record(*args, **kwargs):
+            if self.calls is not None:
+                self.calls.append((name, _freeze(args), kwargs))
+            return self
+
+        return record
+
+    def take(self) -> Dict[str, Optional[list]]:
+        """
+        The groups that were rendered since the last call, only the last version of each
+        """
+        with self.lock:
+            groups, self.groups = self.groups, {}
+        return groups
+
+
+def _freeze(arg):
+    # vec3 attributes of drones are overwritten in place on the next tick
+    if isinstance(arg, vec3):
+        return vec3(arg[0], arg[1], arg[2])
+    if isinstance(arg, (list, tuple)):
+        return type(arg)(_freeze(item) for item in arg)
+    return arg
+
+
+def _same(a, b, threshold: float) -> bool:
+    if isinstance(a, vec3) and isinstance(b, vec3):
+        return norm(a - b) <= threshold
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return len(a) == len(b) and all(_same(x, y, threshold) for x, y in zip(a, b))
+    if isinstance(a, RecordedColor) and isinstance(b, RecordedColor):
+        return a.name == b.name and a.args == b.args
+    return type(a) is type(b) and a == b
+
+
+class RenderLayer(RecordingRenderer):
+    """
+    Render groups that stay on screen across ticks. Steps draw into named groups every tick as usual,
+    but flush() only sends a group when its content changed or a position in it moved more than anchor_threshold.
+    Groups that were not drawn in a tick are cleared.
+    """
+
+    def __init__(self, interface, anchor_threshold: float = 50.0):
+        super().__init__()
+        self.interface = interface
+        self.anchor_threshold = anchor_threshold
+        self.sent: Dict[str, list] = {}
+        self.groups_sent = 0
+        self.groups_skipped = 0
+
+    def flush(self):
+        frame = self.take()
+        renderer = self.interface.renderer
+
+        for group_id, calls in frame.items():
+            if calls is None or not _same(calls, self.sent.get(group_id), self.anchor_threshold):
+                replay({group_id: calls}, renderer)
+                self.groups_sent += 1
+                if calls is None:
+                    self.sent.pop(group_id, None)
+                else:
+                    self.sent[group_id] = calls
+            else:
+                self.groups_skipped += 1
+
+        for group_id in self.sent.keys() - frame.keys():
+            renderer.clear_screen(group_id)
+            del self.sent[group_id]
+
+    def clear(self):
+        for group_id in self.sent:
+            self.interface.renderer.clear_screen(group_id)
+        self.sent.clear()
+
+
+def replay(groups: Dict[str, Optional[list]], renderer):
+    for group_id, calls in groups.items():
+        if calls is None:
+            renderer.clear_screen(group_id)
+            continue
+
+        renderer.begin_rendering(group_id)
+        for name, args, kwargs in calls:
+            args = [arg.resolve(renderer) if isinstance(arg, RecordedColor) else arg for arg in args]
+            kwargs = {key: arg.resolve(renderer) if isinstance(arg, RecordedColor) else arg
+                      for key, arg in kwargs.items()}
+            getattr(renderer, name)(*args, **kwargs)
+        renderer.end_rendering()
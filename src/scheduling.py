@@ -0,0 +1,98 @@
+import os
+import time
+from collections import deque
+from typing import List, Optional, Tuple
+
+from drone import Drone
+from profiling import TICK_BUDGET
+
+NORMAL, DEFER_RENDERING, STAGGER = range(3)
+
+
+class TickScheduler:
+    """
+    Watches how long the runner takes per tick and sheds work when it runs past the deadline.
+    The first level only flushes the render groups every few ticks. The second level also splits the drones
+    in two halves that get their controllers recomputed on alternate ticks, while the other half keeps
+    the controls of the tick before. A level is only taken after several late ticks close together, so that
+    a single hiccup doesn't degrade the show, and dropped again once the ticks have been fast for a while.
+    """
+
+    def __init__(self, deadline: float = TICK_BUDGET * 0.75, recover_after: int = 120, render_interval: int = 4,
+                 escalate_after: int = 3, escalate_window: int = 30):
+        self.deadline = deadline
+        self.recover_after = recover_after
+        self.render_interval = render_interval
+        self.escalate_after = escalate_after
+        self.escalate_window = escalate_window
+        self.level = NORMAL
+        self.tick = 0
+        self.tick_start = 0.0
+        self.fast_ticks = 0
+        # the ticks of the recent late ticks, escalating clears them
+        self.recent_late_ticks = deque(maxlen=escalate_after)
+
+        self.halves_of: Optional[List[Drone]] = None
+        self.halves: Tuple[List[Drone], List[Drone]] = ([], [])
+
+        self.ticks = 0
+        self.late_ticks = 0
+        self.degraded_ticks = [0, 0, 0]
+        self.held_controls = 0
+
+    @staticmethod
+    def from_environment() -> Optional["TickScheduler"]:
+        # AIRSHOW_DEADLINE_MS=<ms>: the compute time per tick to stay under, e.g. 6 to leave room for the game I/O
+        deadline_ms = float(os.environ.get("AIRSHOW_DEADLINE_MS", 0))
+        return TickScheduler(deadline_ms / 1000) if deadline_ms > 0 else None
+
+    def begin_tick(self):
+        self.tick_start = time.perf_counter()
+        self.tick += 1
+
+    def end_tick(self):
+        elapsed = time.perf_counter() - self.tick_start
+        self.ticks += 1
+        self.degraded_ticks[self.level] += 1
+
+        if elapsed > self.deadline:
+            self.late_ticks += 1
+            self.fast_ticks = 0
+            self.recent_late_ticks.append(self.tick)
+            if (len(self.recent_late_ticks) == self.escalate_after
+                    and self.tick - self.recent_late_ticks[0] < self.escalate_window):
+                self.recent_late_ticks.clear()
+                self.level = min(self.level + 1, STAGGER)
+        elif elapsed < self.deadline * 0.5 and self.level > NORMAL:
+            # only step back when there is room for the work the current level saves
+            self.fast_ticks += 1
+            if self.fast_ticks >= self.recover_after:
+                self.fast_ticks = 0
+                self.level -= 1
+
+    def defer_rendering(self) -> bool:
+        return self.level >= DEFER_RENDERING and self.tick % self.render_interval != 0
+
+    def active_drones(self, drones: List[Drone]) -> List[Drone]:
+        """
+        The drones whose controllers run this tick, the same list when nothing is staggered
+        """
+        if self.level < STAGGER or len(drones) < 2:
+            return drones
+        if self.halves_of is not drones:
+            self.halves_of = drones
+            self.halves = (drones[0::2], drones[1::2])
+        active = self.halves[self.tick % 2]
+        self.held_controls += len(drones) - len(active)
+        return active
+
+    def report(self) -> str:
+        return (f"{self.late_ticks}/{self.ticks} ticks over {self.deadline * 1000:.2f} ms, "
+                f"{self.degraded_ticks[DEFER_RENDERING]} with deferred rendering, "
+                f"{self.degraded_ticks[STAGGER]} staggered ({self.held_controls} drone controls reused)")
+
+    def reset(self):
+        self.ticks = 0
+        self.late_ticks = 0
+        self.degraded_ticks = [0, 0, 0]
+        self.held_controls = 0
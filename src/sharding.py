@@ -0,0 +1,204 @@
+import ctypes
+import gc
+import multiprocessing
+import traceback
+from multiprocessing.shared_memory import SharedMemory
+from typing import List, Tuple
+
+import numpy as np
+from rlbot.utils.structures.bot_input_struct import PlayerInput
+
+from drone import Drone
+from input_transport import InputBuffer
+from packet_snapshot import PacketSnapshot
+from rendering import NullRenderer
+from steps import Step, StepContext, StepResult
+
+
+def split_by_airshow_id(drones: List[Drone], count: int) -> List[List[Drone]]:
+    drones = sorted(drones, key=lambda drone: drone.airshow_id)
+    return [drones[i * len(drones) // count:(i + 1) * len(drones) // count] for i in range(count)]
+
+
+def build_step_tree(runner_class: type) -> Step:
+    # generate_sequence only uses class attributes like the geometry, it doesn't need a connected runner
+    runner = runner_class.__new__(runner_class)
+    runner.generate_sequence()
+    runner.step.reset()
+    return runner.step
+
+
+class WorkerInterface:
+    """
+    Rendering is done by the main process, and state setting goes back to it with the step results
+    """
+
+    def __init__(self):
+        self.renderer = NullRenderer()
+
+
+class ShardFailure(RuntimeError):
+    """
+    A worker died, hung up or failed to perform its shard
+    """
+
+
+class ShardPool:
+    """
+    Performs the step tree for shards of the drones in worker processes.
+    The packet snapshot and the controls are in shared memory, only step results go through the pipes.
+    """
+
+    def __init__(self, runner_class: type, drones: List[Drone], shards: List[List[Drone]], max_cars: int):
+        self.snapshot_memory = SharedMemory(create=True, size=PacketSnapshot.nbytes(max_cars))
+        self.inputs_memory = SharedMemory(create=True, size=ctypes.sizeof(PlayerInput) * max_cars)
+        self.snapshot = PacketSnapshot(max_cars, self.snapshot_memory.buf)
+        self.inputs = InputBuffer(max_cars, buffer=self.inputs_memory.buf)
+        self.worker_ids = np.array([drone.id for shard in shards for drone in shard], dtype=int)
+        self.waiting = False
+
+        # spawn instead of fork, the parent has threads and the game connection
+        mp = multiprocessing.get_context("spawn")
+        drone_info = [(drone.id, drone.team, drone.airshow_id) for drone in drones]
+        self.connections = []
+        self.processes = []
+        for i, shard in enumerate(shards):
+            connection, worker_connection = mp.Pipe()
+            process = mp.Process(target=worker_main, name=f"AirshowShard{i}", daemon=True, args=(
+                runner_class, drone_info, [drone.id for drone in shard], max_cars,
+                self.snapshot_memory.name, self.inputs_memory.name, worker_connection,
+            ))
+            process.start()
+            # only the worker keeps its end open, so that the pipe reports when it dies
+            worker_connection.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+    def send(self, command: str, t: float):
+        for connection, process in zip(self.connections, self.processes):
+            try:
+                connection.send((command, t))
+            except OSError as error:
+                raise ShardFailure(f"{process.name} hung up: {error!r}") from error
+
+    def receive(self) -> list:
+        replies = []
+        for connection, process in zip(self.connections, self.processes):
+            while not connection.poll(0.1):
+                if not process.is_alive():
+                    raise ShardFailure(f"{process.name} exited with code {process.exitcode}")
+            try:
+                replies.append(connection.recv())
+            except (EOFError, OSError) as error:
+                raise ShardFailure(f"{process.name} hung up: {error!r}") from error
+        return replies
+
+    def start_round(self, t: float):
+        self.send("start", t)
+
+    def begin_tick(self, t: float):
+        """
+        Lets the workers perform on the snapshot as it is now, it must not change until end_tick
+        """
+        if self.waiting:
+            # the last tick failed before it got the replies, they are outdated now
+            self.receive()
+        self.waiting = True
+        self.send("tick", t)
+
+    def end_tick(self, inputs: InputBuffer) -> StepResult:
+        """
+        Waits for all workers, copies their controls into the inputs and returns their combined results
+        """
+        replies = self.receive()
+        self.waiting = False
+
+        errors = [reply[1] for reply in replies if reply[0] == "error"]
+        if errors:
+            raise ShardFailure("shard worker failed:\n" + "\n".join(errors))
+
+        result = StepResult()
+        for _, car_states, ball_state in replies:
+            result += StepResult(car_states=car_states or {}, ball_state=ball_state)
+
+        inputs.array[self.worker_ids] = self.inputs.array[self.worker_ids]
+        return result
+
+    def close(self):
+        for connection in self.connections:
+            try:
+                connection.send(("stop", 0.0))
+            except OSError:
+                pass
+        for process in self.processes:
+            process.join(timeout=1.0)
+            if process.is_alive():
+                process.terminate()
+
+        # the numpy and ctypes views have to go before the memory can be closed
+        del self.snapshot, self.inputs
+        gc.collect()
+        for memory in (self.snapshot_memory, self.inputs_memory):
+            memory.unlink()
+            try:
+                memory.close()
+            except BufferError:
+                # something still holds a view, the mapping goes away with it
+                pass
+
+
+def worker_main(runner_class: type, drone_info: List[Tuple[int, int, int]], shard_ids: List[int], max_cars: int,
+                snapshot_name: str, inputs_name: str, connection):
+    snapshot_memory = SharedMemory(name=snapshot_name)
+    inputs_memory = SharedMemory(name=inputs_name)
+    serve(runner_class, drone_info, shard_ids, PacketSnapshot(max_cars, snapshot_memory.buf),
+          InputBuffer(max_cars, shard_ids, inputs_memory.buf), connection)
+
+    # drones and controllers reference each other, so collect them before the shared buffers are released
+    gc.collect()
+    snapshot_memory.close()
+    inputs_memory.close()
+
+
+def serve(runner_class: type, drone_info: List[Tuple[int, int, int]], shard_ids: List[int],
+          snapshot: PacketSnapshot, inputs: InputBuffer, connection):
+    peers = [Drone(*info) for info in drone_info]
+    drones = [drone for drone in peers if drone.id in set(shard_ids)]
+    others = [drone for drone in peers if drone.id not in set(shard_ids)]
+    context = StepContext(drones, WorkerInterface(), None, runner_class.geometry, peers=peers)
+    step = None
+    error = "no round started"
+
+    while True:
+        command, t = connection.recv()
+        if command == "stop":
+            break
+
+        try:
+            if command == "start":
+                step = build_step_tree(runner_class)
+                if t > 0.0:
+                    step.seek(t)
+                continue
+
+            if step is None:
+                connection.send(("error", error))
+                continue
+
+            snapshot.load()
+            for drone in drones:
+                drone.update(snapshot)
+            # the other drones are only read as peers, their fields are converted when a step reads them
+            for drone in others:
+                drone.update(snapshot, reset_controls=False)
+            result = step.perform(context, t)
+            for drone in drones:
+                drone.write_player_input(inputs[drone.id])
+            connection.send(("result", result.car_states or None, result.ball_state))
+
+        except Exception:
+            if command == "start":
+                step = None
+                error = traceback.format_exc()
+            else:
+                connection.send(("error", traceback.format_exc()))
@@ -0,0 +1,206 @@
+import dataclasses
+import hashlib
+import importlib
+import json
+from pathlib import Path
+from typing import Dict, List, Tuple, Any
+
+from polar_utils import FormationGeometry
+from rlutilities.linear_algebra import vec2, vec3
+from steps import Step, CompositeStep, ParallelStep, PartialStep, Wait
+
+SHOW_DIR = Path(__file__).parent / "shows"
+FORMAT_VERSION = 1
+
+# modules whose Step subclasses can be used in show files, looked up on every compile so that reloads are picked up
+STEP_MODULES = ("steps", "evaluation", "choreography")
+
+
+class ShowError(ValueError):
+    pass
+
+
+def show_path(name: str) -> Path:
+    """
+    A show from the shows directory by name, or a path to a json file
+    """
+    if name.endswith(".json"):
+        return Path(name)
+    return SHOW_DIR / f"{name}.json"
+
+
+def step_registry() -> Dict[str, type]:
+    registry = {}
+    for module_name in STEP_MODULES:
+        module = importlib.import_module(module_name)
+        for value in vars(module).values():
+            if isinstance(value, type) and issubclass(value, Step) and value.__module__ == module_name:
+                registry[value.__name__] = value
+    return registry
+
+
+class ShowCompiler:
+    """
+    Turns a show file into a step tree.
+
+    A node is {"type": "<Step class>", <field>: <value>, ...}. Containers take their children in "steps",
+    a PartialStep takes one child in "step" and "airshow_ids" as a list, "human_ring" or {"ring": <index>}.
+    {"macro": "<name>", "args": {...}} is replaced by the macro, which is a node or a list of nodes,
+    and "$<arg>" anywhere in it by the argument. Macros see the arguments of the macros they are used in.
+    {"type": "Rings", "steps": [...]} performs the steps in every ring of the formation after the ring's delay,
+    with "$evaluated" set for the rings with humans, which are wrapped in an EvaluateStep.
+    """
+
+    def __init__(self, show: dict, geometry: FormationGeometry, registry: Dict[str, type]):
+        if not isinstance(show, dict) or show.get("format") != FORMAT_VERSION:
+            raise ShowError(f"not a show file of format {FORMAT_VERSION}")
+        self.macros: Dict[str, Any] = show.get("macros", {})
+        self.show = show.get("show")
+        self.geometry = geometry
+        self.registry = registry
+        if not isinstance(self.show, list):
+            raise ShowError("\"show\" has to be a list of steps")
+
+    def compile(self) -> Step:
+        return CompositeStep(steps=self.nodes(self.show, "show", {}))
+
+    def nodes(self, nodes, path: str, args: dict) -> List[Step]:
+        if not isinstance(nodes, list):
+            raise ShowError(f"{path}: expected a list of steps")
+        steps = []
+        for i, node in enumerate(nodes):
+            steps += self.node(node, f"{path}[{i}]", args)
+        return steps
+
+    def node(self, node, path: str, args: dict) -> List[Step]:
+        if not isinstance(node, dict):
+            raise ShowError(f"{path}: expected an object")
+
+        if "macro" in node:
+            name = node["macro"]
+            if name not in self.macros:
+                raise ShowError(f"{path}: unknown macro {name!r}")
+            if path.count("macro ") > 32:
+                raise ShowError(f"{path}: macros nested too deep")
+            macro_args = {**args, **self.value(node.get("args", {}), path, args)}
+            body = self.macros[name]
+            macro_path = f"{path} macro {name}"
+            return self.nodes(body, macro_path, macro_args) if isinstance(body, list) \
+                else self.node(body, macro_path, macro_args)
+
+        node_type = node.get("type")
+        fields = {key: value for key, value in node.items() if key != "type"}
+        if node_type == "Rings":
+            return [self.rings(fields, path, args)]
+        if node_type not in self.registry:
+            raise ShowError(f"{path}: unknown step type {node_type!r}")
+        cls = self.registry[node_type]
+
+        if issubclass(cls, (CompositeStep, ParallelStep)):
+            fields["steps"] = self.nodes(fields.get("steps"), f"{path}.steps", args)
+        elif issubclass(cls, PartialStep):
+            fields["step"] = self.single(fields.get("step"), f"{path}.step", args)
+            fields["airshow_ids"] = self.airshow_ids(self.value(fields.get("airshow_ids"), path, args), path)
+
+        return [self.instance(cls, fields, path, args)]
+
+    def single(self, node, path: str, args: dict) -> Step:
+        steps = self.node(node, path, args)
+        return steps[0] if len(steps) == 1 else CompositeStep(steps=steps)
+
+    def rings(self, fields: dict, path: str, args: dict) -> Step:
+        geometry = self.geometry
+        shows = []
+        for ring in range(len(geometry.rings)):
+            evaluated = ring in geometry.human_rings
+            delay = geometry.rings[ring].delay
+            steps = ([Wait(delay)] if delay else []) + \
+                self.nodes(fields.get("steps"), f"{path}.steps", {**args, "evaluated": evaluated})
+            step = self.registry["EvaluateStep"](steps=steps) if evaluated else CompositeStep(steps=steps)
+            shows.append(PartialStep(airshow_ids=geometry.ring_ids[ring], step=step))
+        return ParallelStep(steps=shows)
+
+    def airshow_ids(self, value, path: str):
+        if value == "human_ring":
+            return self.geometry.human_ring_ids
+        if isinstance(value, dict) and isinstance(value.get("ring"), int) \
+                and 0 <= value["ring"] < len(self.geometry.rings):
+            return self.geometry.ring_ids[value["ring"]]
+        if isinstance(value, list) and all(isinstance(i, int) for i in value):
+            return value
+        raise ShowError(f"{path}: airshow_ids has to be a list of ids, \"human_ring\" or {{\"ring\": <index>}}")
+
+    def instance(self, cls: type, fields: dict, path: str, args: dict) -> Step:
+        declared = {field.name: field for field in dataclasses.fields(cls) if field.init}
+        values = {}
+        for name, value in fields.items():
+            if name not in declared:
+                raise ShowError(f"{path}: {cls.__name__} has no field {name!r}")
+            if name in ("steps", "step", "airshow_ids") and issubclass(cls, (CompositeStep, ParallelStep, PartialStep)):
+                values[name] = value  # compiled already
+            else:
+                field_path = f"{path}.{name}"
+                values[name] = convert(self.value(value, field_path, args), declared[name].type, field_path)
+        return cls(**values)
+
+    def value(self, value, path: str, args: dict):
+        if isinstance(value, str) and value.startswith("$"):
+            if value[1:] not in args:
+                raise ShowError(f"{path}: {value} is not an argument here")
+            return args[value[1:]]
+        if isinstance(value, list):
+            return [self.value(item, path, args) for item in value]
+        if isinstance(value, dict):
+            return {key: self.value(item, path, args) for key, item in value.items()}
+        return value
+
+
+def convert(value, field_type, path: str):
+    if field_type in (vec2, vec3):
+        size = 2 if field_type is vec2 else 3
+        if not isinstance(value, list) or len(value) != size or not all(_is_number(v) for v in value):
+            raise ShowError(f"{path}: expected a list of {size} numbers")
+        return field_type(*value)
+    if field_type is bool:
+        if not isinstance(value, bool):
+            raise ShowError(f"{path}: expected true or false")
+        return value
+    if field_type is float:
+        if not _is_number(value):
+            raise ShowError(f"{path}: expected a number")
+        return float(value)
+    if field_type is int:
+        if not _is_number(value) or not float(value).is_integer():
+            raise ShowError(f"{path}: expected a whole number")
+        return int(value)
+    if field_type is str and not isinstance(value, str):
+        raise ShowError(f"{path}: expected a string")
+    return value
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+# kept across importlib.reload, like the geometry cache
+_show_cache: Dict[Tuple, Step] = globals().get("_show_cache", {})
+
+
+def load_show(path: Path, geometry: FormationGeometry) -> Step:
+    """
+    The compiled step tree of a show file. Trees are cached by the content of the file, the geometry
+    and the step classes, so the same tree is handed out again until one of them changes.
+    Reset it before performing it again.
+    """
+    content = path.read_bytes()
+    registry = step_registry()
+    key = (hashlib.sha256(content).hexdigest(), id(geometry), tuple(map(id, registry.values())))
+    if key not in _show_cache:
+        if len(_show_cache) > 16:
+            _show_cache.clear()
+        try:
+            show = json.loads(content)
+        except ValueError as ex:
+            raise ShowError(f"{path}: {ex}") from ex
+        _show_cache[key] = ShowCompiler(show, geometry, registry).compile()
+    return _show_cache[key]
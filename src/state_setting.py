@@ -0,0 +1,208 @@
+import math
+from typing import List, Optional
+
+import numpy as np
+from rlbot.utils.game_state_util import GameState, CarState, BallState, Physics, Vector3, Rotator
+
+from packet_snapshot import PacketSnapshot, euler_to_rotation
+from steps import StepResult
+
+# columns of a desired state row, nan means the component isn't set
+LOCATION, ROTATION, VELOCITY, ANGULAR_VELOCITY = slice(0, 3), slice(3, 6), slice(6, 9), slice(9, 12)
+BOOST, JUMPED, DOUBLE_JUMPED = 12, 13, 14
+COLUMNS = 15
+
+# differences below these don't need to be sent
+TOLERANCES = np.array([1.0] * 3 + [0.002] * 3 + [1.0] * 3 + [0.01] * 3 + [1.0, 0.5, 0.5])
+ROTATION_TOLERANCE = 0.002  # radians between the orientations
+
+
+class StateSetScheduler:
+    """
+    Collects the car and ball states the steps ask for and sends them in at most one set_game_state call per tick.
+    Only components that differ from the packet are sent, and components that were sent a moment ago
+    are not sent again before the packet had a chance to show them.
+    When more than `budget` objects need a state, the ones that waited longest go first
+    and the rest stay pending, merged with whatever is requested for them in the next ticks.
+    """
+
+    def __init__(self, interface, max_cars: int, budget: int = 16,
+                 settle_time: float = 2 / 120, max_age: float = 0.25):
+        self.interface = interface
+        self.max_cars = max_cars
+        self.budget = budget
+        self.settle_time = settle_time
+        self.max_age = max_age
+
+        # one row per car, the last row is the ball
+        self.pending = np.full((max_cars + 1, COLUMNS), np.nan)
+        self.pending_since = np.full(max_cars + 1, np.inf)
+        self.sent = np.full((max_cars + 1, COLUMNS), np.nan)
+        self.sent_time = np.full(max_cars + 1, -np.inf)
+        self.current = np.full((max_cars + 1, COLUMNS), np.nan)
+
+        # what the last flush sent, for recording
+        self.sent_rows = np.empty(0, dtype=int)
+        self.sent_values = np.empty((0, COLUMNS))
+
+        self.calls = 0
+        self.objects_requested = 0
+        self.objects_sent = 0
+
+    def request(self, result: StepResult, time: float):
+        for index, car_state in result.car_states.items():
+            if 0 <= index < self.max_cars:
+                self.merge(index, car_state_row(car_state), time)
+        if result.ball_state is not None and result.ball_state.physics is not None:
+            self.merge(self.max_cars, physics_row(result.ball_state.physics) + [math.nan] * 3, time)
+
+    def merge(self, row: int, values: List[float], time: float):
+        values = np.array(values)
+        mask = ~np.isnan(values)
+        self.pending[row, mask] = values[mask]
+        self.pending_since[row] = min(self.pending_since[row], time)
+        self.objects_requested += 1
+
+    def clear(self, rows: np.ndarray):
+        self.pending[rows] = np.nan
+        self.pending_since[rows] = np.inf
+
+    def flush(self, snapshot: PacketSnapshot):
+        self.sent_rows = self.sent_rows[:0]
+        rows = np.flatnonzero(np.isfinite(self.pending_since))
+        if not len(rows):
+            return
+        now = snapshot.time
+
+        # a request that waited this long would put the car where it should have been a while ago
+        stale = now - self.pending_since[rows] > self.max_age
+        self.clear(rows[stale])
+        rows = rows[~stale]
+
+        self.update_current(snapshot)
+        pending = self.pending[rows]
+        current = self.current[rows]
+        # the rotation is one unit: partly requested rotations are completed from the packet,
+        # and it's compared by the angle between the orientations, Euler angles differ a lot near gimbal lock
+        rotation = pending[:, ROTATION]
+        has_rotation = np.isfinite(rotation).any(axis=1)
+        rotation[:] = np.where(np.isnan(rotation) & has_rotation[:, None], current[:, ROTATION], rotation)
+
+        recent = now - self.sent_time[rows] < self.settle_time
+        needed = np.isfinite(pending) & ~(np.abs(difference(pending, current)) <= TOLERANCES)
+        needed &= ~(recent[:, None] & (np.abs(difference(pending, self.sent[rows])) <= TOLERANCES))
+        rotation_needed = has_rotation & ~(rotation_angles(rotation, current[:, ROTATION]) <= ROTATION_TOLERANCE)
+        rotation_needed &= ~(recent & (rotation_angles(rotation, self.sent[rows, ROTATION]) <= ROTATION_TOLERANCE))
+        needed[:, ROTATION] = rotation_needed[:, None]
+
+        # requests the game already matches are done
+        wanted = needed.any(axis=1)
+        self.clear(rows[~wanted])
+        rows, pending, needed = rows[wanted], pending[wanted], needed[wanted]
+        if not len(rows):
+            return
+
+        order = np.argsort(self.pending_since[rows], kind="stable")[:self.budget]
+        rows = rows[order]
+        values = np.where(needed[order], pending[order], np.nan)
+
+        self.sent[rows] = values
+        self.sent_time[rows] = now
+        self.sent_rows, self.sent_values = rows, values
+        self.clear(rows)
+
+        cars = {}
+        ball = None
+        for row, row_values in zip(rows.tolist(), values.tolist()):
+            if row == self.max_cars:
+                ball = BallState(physics=row_physics(row_values))
+            else:
+                cars[row] = row_car_state(row_values)
+
+        self.calls += 1
+        self.objects_sent += len(rows)
+        self.interface.set_game_state(GameState(cars=cars or None, ball=ball))
+
+    def update_current(self, snapshot: PacketSnapshot):
+        n = snapshot.num_cars
+        current = self.current
+        current[:n, LOCATION] = snapshot.positions[:n]
+        current[:n, ROTATION] = snapshot.rotators[:n]
+        current[:n, VELOCITY] = snapshot.velocities[:n]
+        current[:n, ANGULAR_VELOCITY] = snapshot.angular_velocities[:n]
+        current[:n, BOOST] = snapshot.boost[:n]
+        current[:n, JUMPED] = snapshot.jumped[:n]
+        current[:n, DOUBLE_JUMPED] = snapshot.double_jumped[:n]
+
+        ball = self.max_cars
+        current[ball, LOCATION] = snapshot.ball[0]
+        current[ball, VELOCITY] = snapshot.ball[1]
+        current[ball, ANGULAR_VELOCITY] = snapshot.ball[2]
+
+
+def difference(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    diff = a - b
+    diff[:, ROTATION] = (diff[:, ROTATION] + math.pi) % (2 * math.pi) - math.pi
+    return diff
+
+
+def rotation_angles(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Angle between the orientations given by rows of pitch, yaw and roll, nan where either isn't set
+    """
+    cos = (np.einsum("nij,nij->n", euler_to_rotation(a), euler_to_rotation(b)) - 1) / 2
+    return np.arccos(np.clip(cos, -1.0, 1.0))
+
+
+def _components(vector, names) -> List[float]:
+    if vector is None:
+        return [math.nan] * 3
+    return [math.nan if getattr(vector, name) is None else getattr(vector, name) for name in names]
+
+
+def _value(value) -> float:
+    return math.nan if value is None else float(value)
+
+
+def physics_row(physics: Optional[Physics]) -> List[float]:
+    if physics is None:
+        return [math.nan] * 12
+    xyz = ("x", "y", "z")
+    return (_components(physics.location, xyz) + _components(physics.rotation, ("pitch", "yaw", "roll")) +
+            _components(physics.velocity, xyz) + _components(physics.angular_velocity, xyz))
+
+
+def car_state_row(car_state: CarState) -> List[float]:
+    return physics_row(car_state.physics) + [
+        _value(car_state.boost_amount), _value(car_state.jumped), _value(car_state.double_jumped)
+    ]
+
+
+def _optional(values: List[float]) -> List[Optional[float]]:
+    return [None if value != value else value for value in values]
+
+
+def _vector(components: List[Optional[float]], cls):
+    return cls(*components) if any(value is not None for value in components) else None
+
+
+def row_physics(values: List[float]) -> Optional[Physics]:
+    location, rotation, velocity, angular_velocity = (_optional(values[i:i + 3]) for i in range(0, 12, 3))
+    if not any(value is not None for value in location + rotation + velocity + angular_velocity):
+        return None
+    return Physics(
+        location=_vector(location, Vector3),
+        rotation=_vector(rotation, Rotator),
+        velocity=_vector(velocity, Vector3),
+        angular_velocity=_vector(angular_velocity, Vector3),
+    )
+
+
+def row_car_state(values: List[float]) -> CarState:
+    boost, jumped, double_jumped = _optional(values[BOOST:])
+    return CarState(
+        physics=row_physics(values),
+        boost_amount=boost,
+        jumped=None if jumped is None else bool(jumped),
+        double_jumped=None if double_jumped is None else bool(double_jumped),
+    )
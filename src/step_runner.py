@@ -1,60 +1,269 @@
-from typing import Optional, Dict, Tuple
+import os
+import time
+from pathlib import Path
+from typing import Optional, List, Dict, Tuple
 
-from rlbot.utils.game_state_util import GameState
-from rlbot.utils.structures.bot_input_struct import PlayerInput
-from rlbot.utils.structures.game_data_struct import GameTickPacket, PlayerInfo
+from rlbot.utils.structures.game_data_struct import GameTickPacket
 from rlbot.utils.structures.game_interface import GameInterface
 
 from drone import Drone
-from evaluation import EvaluateStep
+from evaluation import EvaluateStep, Scoreboard
+from input_transport import InputBuffer
+from packet_snapshot import PacketSnapshot
+from polar_utils import FormationGeometry, geometry
+from profiling import TickProfiler
+from reference import ReferenceTrajectory
+from rendering import RenderLayer, NullRenderer
+from scheduling import TickScheduler
+from sharding import ShardPool, ShardFailure, split_by_airshow_id
+from state_setting import StateSetScheduler
 from steps import Step, StepContext
+from timeline import Timeline
 
 
 class StepRunner:
-    choreo_human_index = None
+    geometry: FormationGeometry = geometry
+    state_set_budget = 16  # cars (and the ball) that get a new state per tick
 
     def __init__(self, interface: GameInterface, packet: GameTickPacket):
         self.interface = interface
-        index_offset = -1 if find_human(packet) is not None else 0
-        self.drones = [Drone(i, packet.game_cars[i].team,
-                             (i if i + index_offset < self.choreo_human_index else i + 1) + index_offset)
-                       for i in range(packet.num_cars) if packet.game_cars[i].is_bot]
+        bots = [i for i in range(packet.num_cars) if packet.game_cars[i].is_bot]
+        self.drones = [Drone(i, packet.game_cars[i].team, airshow_id)
+                       for i, airshow_id in zip(bots, self.geometry.assign_slots(len(bots)))]
+
+        self.context: Optional[StepContext] = None
+        # one context per group of active drones and renderer, so that the subsets of the partial steps are reused
+        self.contexts: Dict[Tuple[int, bool], StepContext] = {}
+        self.snapshot = PacketSnapshot(len(packet.game_cars))
+
+        # AIRSHOW_WORKERS=<n>: n worker processes each control a shard of the drones, this process keeps one too
+        self.local_drones = self.drones
+        self.remote_drones: List[Drone] = []
+        self.pool: Optional[ShardPool] = None
+        worker_count = int(os.environ.get("AIRSHOW_WORKERS", 0))
+        if worker_count > 0 and self.drones:
+            shards = split_by_airshow_id(self.drones, worker_count + 1)
+            self.local_drones = shards[0]
+            self.remote_drones = [drone for shard in shards[1:] for drone in shard]
+            self.pool = ShardPool(type(self), self.drones, shards[1:], len(packet.game_cars))
+            self.snapshot = self.pool.snapshot
+
+        self.inputs = InputBuffer(len(packet.game_cars), [drone.id for drone in self.drones])
+        # the humans in the order of the slots they fly in, player is the first of them
+        self.players: List[Drone] = []
+        self.human_indices: List[int] = []
+        self.player: Optional[Drone] = None
+        self.scoreboard = Scoreboard(self.geometry.slot_count)
+        self.render_layer = RenderLayer(interface)
+        self.null_renderer = NullRenderer()
+        self.state_setter = StateSetScheduler(interface, len(packet.game_cars), self.state_set_budget)
 
         self.step: Optional[Step] = None
+        self.timeline: Optional[Timeline] = None
         self.last_reset_time = 0
+        self.t = 0.0
+
+        # rehearsal: start the first round somewhere in the middle of the show
+        self.start_at = float(os.environ.get("AIRSHOW_START_AT", 0.0))
+
+        # AIRSHOW_TELEMETRY=<directory>: save the evaluated frames of every round, see telemetry.py
+        telemetry_dir = os.environ.get("AIRSHOW_TELEMETRY")
+        self.telemetry_dir = Path(telemetry_dir) if telemetry_dir else None
+
+        # AIRSHOW_REFERENCE=<file>: score the players against a trajectory recorded with AIRSHOW_RECORD_REFERENCE
+        # or headless.py --record-reference, in a run with the same formation
+        reference = os.environ.get("AIRSHOW_REFERENCE")
+        if reference:
+            EvaluateStep.reference = ReferenceTrajectory.load(Path(reference))
 
-    def get_outputs(self, packet: GameTickPacket) -> Dict[int, PlayerInput]:
+        # AIRSHOW_RECORD_REFERENCE=<file>: record the reference trajectory of every full round into the file,
+        # rounds that didn't record all of the evaluated steps aren't saved
+        record_reference = os.environ.get("AIRSHOW_RECORD_REFERENCE")
+        self.reference_path = Path(record_reference) if record_reference else None
+
+        self.scheduler = TickScheduler.from_environment()
+        self.profiler = TickProfiler.from_environment()
+        if self.profiler:
+            self.profiler.install(interface)
+
+    def get_outputs(self, packet: GameTickPacket) -> InputBuffer:
+        if self.profiler:
+            self.profiler.begin_tick()
         if self.step is None:
-            self.generate_sequence()
-            EvaluateStep.reset_score()
-            self.last_reset_time = packet.game_info.seconds_elapsed
+            self.start_round(packet.game_info.seconds_elapsed, self.start_at)
+            self.scoreboard.reset()
+            self.start_at = 0.0
+
+        # the scheduler times the tick itself, not the setup of a round or the saving at its end
+        if self.scheduler:
+            self.scheduler.begin_tick()
 
-        for drone in self.drones:
-            drone.update(packet.game_cars[drone.id], packet)
+        self.snapshot.update(packet)
+        active = self.scheduler.active_drones(self.local_drones) if self.scheduler else self.local_drones
+        if active is self.local_drones:
+            for drone in self.local_drones:
+                drone.update(self.snapshot)
+        else:
+            # the drones left out this tick keep their controls
+            active_ids = {drone.id for drone in active}
+            for drone in self.local_drones:
+                drone.update(self.snapshot, reset_controls=drone.id in active_ids)
+        # the drones of the workers are only read as peers, their fields are converted when a step reads them
+        for drone in self.remote_drones:
+            drone.update(self.snapshot, reset_controls=False)
+        players = self.update_players()
 
-        player = find_human(packet)
-        if player:
-            player_index, player_info = player
-            player = Drone(player_index, player_info.team, self.choreo_human_index)
-            player.update(player_info, packet)
+        t = self.t = packet.game_info.seconds_elapsed - self.last_reset_time
+        if self.pool:
+            try:
+                self.pool.begin_tick(t)
+            except ShardFailure as failure:
+                self.take_back_shards(failure, packet)
 
-        t = packet.game_info.seconds_elapsed - self.last_reset_time
-        self.interface.renderer.begin_rendering()
-        result = self.step.perform(StepContext(self.drones, self.interface, player), t)
-        self.interface.renderer.end_rendering()
+        # while rendering is deferred the steps draw into nothing, the next flushed tick draws everything again
+        deferred = bool(self.scheduler and self.scheduler.defer_rendering())
+        if self.context is not None and self.context.players is not players:
+            self.contexts.clear()
+        key = (id(active), deferred)
+        self.context = self.contexts.get(key)
+        if self.context is None:
+            self.context = self.contexts[key] = StepContext(
+                active, self.interface, self.player, self.geometry,
+                peers=self.drones if active is not self.drones else None,
+                renderer=self.null_renderer if deferred else self.render_layer,
+                players=players, scoreboard=self.scoreboard)
+        result = self.step.perform(self.context, t)
+        if not deferred:
+            self.render_layer.flush()
+
+        if self.pool:
+            try:
+                result += self.pool.end_tick(self.inputs)
+            except ShardFailure as failure:
+                self.take_back_shards(failure, packet)
 
         if result.car_states or result.ball_state:
-            self.interface.set_game_state(GameState(cars=result.car_states or None, ball=result.ball_state))
+            self.state_setter.request(result, self.snapshot.time)
+        self.state_setter.flush(self.snapshot)
+
+        if self.profiler:
+            self.profiler.render_overlay(self.interface.renderer)
+
+        for drone in self.local_drones:
+            drone.write_player_input(self.inputs[drone.id])
+        if self.scheduler:
+            self.scheduler.end_tick()
 
         if result.finished:
             self.step = None
+            if self.profiler:
+                self.profiler.end_round()
+            if self.scheduler:
+                print(f"Tick scheduler: {self.scheduler.report()}")
+                self.scheduler.reset()
+            if self.telemetry_dir:
+                self.telemetry_dir.mkdir(parents=True, exist_ok=True)
+                EvaluateStep.recorder.save(self.telemetry_dir / time.strftime("evaluation-%Y%m%d-%H%M%S.npz"))
+            if self.reference_path:
+                self.save_reference()
+
+        return self.inputs
+
+    def start_round(self, seconds_elapsed: float, t: float = 0.0):
+        """
+        Builds the step tree and positions it at time t of the show
+        """
+        self.generate_sequence()
+        self.step.reset()
+        # shows are compiled once, so the step tree and its timeline are usually the ones of the last round
+        if self.timeline is None or self.timeline.root is not self.step:
+            self.timeline = Timeline(self.step)
+        if t > 0.0:
+            self.timeline.seek(t)
+        if self.pool:
+            self.pool.start_round(t)
+        if self.reference_path:
+            EvaluateStep.reference_recording = ReferenceTrajectory.empty(self.evaluated_duration())
+        self.last_reset_time = seconds_elapsed - t
+
+    def evaluated_duration(self) -> float:
+        """
+        How long the longest evaluated step of the show runs
+        """
+        return max((entry.end - entry.start for entry in self.timeline.entries
+                    if isinstance(entry.step, EvaluateStep)), default=0.0)
+
+    def save_reference(self):
+        recording = EvaluateStep.reference_recording
+        evaluated = self.evaluated_duration()
+        recorded = recording.trimmed().duration() if recording.filled.any() else 0.0
+        if recorded < evaluated - 1 / ReferenceTrajectory.rate:
+            print(f"Reference trajectory not saved, only {recorded:.1f}s of {evaluated:.1f}s were recorded")
+            return
+        recording.save(self.reference_path)
+        print(f"Saved {recorded:.1f}s of reference trajectory to {self.reference_path}")
 
-        return {drone.id: drone.get_player_input() for drone in self.drones}
+    def take_back_shards(self, failure: ShardFailure, packet: GameTickPacket):
+        """
+        Stops the workers and controls all drones in this process from now on
+        """
+        print(f"{failure}\nStopped the shard workers, their drones are controlled by the main process now")
+        self.snapshot = PacketSnapshot(len(packet.game_cars))
+        self.snapshot.update(packet)
+        for drone in self.drones + self.players:
+            drone.snapshot = self.snapshot
+        self.local_drones = self.drones
+        self.remote_drones = []
+        self.contexts.clear()
+        self.pool.close()
+        self.pool = None
+
+    def close(self):
+        self.render_layer.clear()
+        if self.pool:
+            self.pool.close()
+            self.pool = None
+
+    def save_state(self) -> dict:
+        return {
+            "t": self.t,
+            "last_reset_time": self.last_reset_time,
+            "running": self.step is not None,
+            "scoreboard": self.scoreboard,
+            "recorder": EvaluateStep.recorder,
+        }
+
+    def restore_state(self, state: dict):
+        """
+        Continues where the runner that saved the state left off, e.g. after the choreography was hot reloaded
+        """
+        if not state["running"]:
+            return
+        self.start_round(state["last_reset_time"] + state["t"], state["t"])
+        if state["scoreboard"].totals.shape == self.scoreboard.totals.shape:
+            self.scoreboard = state["scoreboard"]
+        EvaluateStep.recorder = state["recorder"]
+
+    def update_players(self) -> List[Drone]:
+        """
+        The humans in packet order take the human slots of the geometry in order, humans without a slot are left out.
+        The list is only replaced when someone joins or leaves.
+        """
+        indices = self.snapshot.human_indices()
+        if indices != self.human_indices:
+            self.human_indices = indices
+            if len(indices) > len(self.geometry.human_slots):
+                print(f"{len(indices)} humans, but the formation has {len(self.geometry.human_slots)} human slots "
+                      f"(AIRSHOW_HUMANS), cars {indices[len(self.geometry.human_slots):]} aren't scored")
+            known = {player.id: player for player in self.players}
+            self.players = [known[i] if i in known and known[i].airshow_id == slot else
+                            Drone(i, int(self.snapshot.team[i]), slot)
+                            for i, slot in zip(indices, self.geometry.human_slots)]
+            self.player = self.players[0] if self.players else None
+        for player in self.players:
+            player.update(self.snapshot)
+        return self.players
 
     def generate_sequence(self):
         raise NotImplementedError
 
-
-def find_human(packet: GameTickPacket) -> Optional[Tuple[int, PlayerInfo]]:
-    human_players = [(i, car) for i, car in enumerate(packet.game_cars[:packet.num_cars]) if not car.is_bot]
-    return human_players[0] if human_players else None
@@ -1,11 +1,14 @@
 import dataclasses
+from bisect import bisect_right
 from dataclasses import dataclass, field
-from typing import Dict, List, Collection, Optional
+from types import MappingProxyType
+from typing import Dict, List, Collection, Optional, Mapping, Tuple
 
 from rlbot.utils.game_state_util import CarState, Physics, Vector3, Rotator, BallState
 from rlbot.utils.structures.game_interface import GameInterface
 
 from drone import Drone
+from polar_utils import FormationGeometry
 from rlutilities.linear_algebra import vec3, mat3, rotation_to_euler
 
 
@@ -28,6 +31,43 @@ class StepContext:
     drones: List[Drone]
     interface: GameInterface
     player: Optional[Drone]
+    geometry: FormationGeometry
+    drones_by_airshow_id: Mapping[int, Drone] = None
+    # the whole group the drones belong to, when only a shard of it is controlled here
+    peers: List[Drone] = None
+    peers_by_airshow_id: Mapping[int, Drone] = None
+    # where steps draw, by default the renderer of the interface
+    renderer: object = None
+    # every human taking part, player is the first of them
+    players: List[Drone] = None
+    # evaluation.Scoreboard of the round
+    scoreboard: object = None
+
+    def __post_init__(self):
+        if self.players is None:
+            self.players = [self.player] if self.player is not None else []
+        if self.renderer is None:
+            self.renderer = self.interface.renderer
+        if self.drones_by_airshow_id is None:
+            self.drones_by_airshow_id = MappingProxyType({drone.airshow_id: drone for drone in self.drones})
+        if self.peers is None:
+            self.peers = self.drones
+            self.peers_by_airshow_id = self.drones_by_airshow_id
+        elif self.peers_by_airshow_id is None:
+            self.peers_by_airshow_id = MappingProxyType({drone.airshow_id: drone for drone in self.peers})
+
+    def subset(self, airshow_ids: Collection[int]) -> "StepContext":
+        airshow_ids = set(airshow_ids)
+        drones = [self.drones_by_airshow_id[i] for i in sorted(airshow_ids & self.drones_by_airshow_id.keys())]
+        # the humans fly in slots too, only the ones in the subset belong to it
+        players = [player for player in self.players if player.airshow_id in airshow_ids]
+        player = players[0] if players else None
+        if self.peers is self.drones:
+            return dataclasses.replace(self, drones=drones, drones_by_airshow_id=None,
+                                       peers=None, peers_by_airshow_id=None, players=players, player=player)
+        peers = [self.peers_by_airshow_id[i] for i in sorted(airshow_ids & self.peers_by_airshow_id.keys())]
+        return dataclasses.replace(self, drones=drones, drones_by_airshow_id=None,
+                                   peers=peers, peers_by_airshow_id=None, players=players, player=player)
 
 
 @dataclass
@@ -40,6 +80,21 @@ class Step:
     def perform(self, context: StepContext, t: float) -> StepResult:
         raise NotImplementedError
 
+    def total_duration(self) -> float:
+        return self.duration
+
+    def seek(self, t: float):
+        """
+        Moves the step to time t, as if it had been running for that long
+        """
+        pass
+
+    def reset(self):
+        """
+        Puts the step back to its start, so that the same tree can be performed again in the next round
+        """
+        pass
+
 
 @dataclass
 class CompositeStep(Step):
@@ -48,6 +103,7 @@ class CompositeStep(Step):
     def __post_init__(self):
         self.current_step_index = 0
         self.current_step_start_t = 0
+        self._child_starts: Optional[List[float]] = None
 
     def perform(self, context: StepContext, t: float) -> StepResult:
         result = self.steps[self.current_step_index].perform(context, t - self.current_step_start_t)
@@ -58,6 +114,33 @@ class CompositeStep(Step):
                 result.finished = False
         return result
 
+    def total_duration(self) -> float:
+        return sum(step.total_duration() for step in self.steps)
+
+    def child_starts(self) -> List[float]:
+        """
+        Start time of every child relative to this step, computed on first use
+        """
+        if self._child_starts is None:
+            self._child_starts = []
+            start = 0.0
+            for step in self.steps:
+                self._child_starts.append(start)
+                start += step.total_duration()
+        return self._child_starts
+
+    def seek(self, t: float):
+        starts = self.child_starts()
+        self.current_step_index = max(bisect_right(starts, t) - 1, 0)
+        self.current_step_start_t = starts[self.current_step_index]
+        self.steps[self.current_step_index].seek(t - self.current_step_start_t)
+
+    def reset(self):
+        self.current_step_index = 0
+        self.current_step_start_t = 0
+        for step in self.steps:
+            step.reset()
+
 
 @dataclass
 class ParallelStep(Step):
@@ -69,16 +152,44 @@ class ParallelStep(Step):
             result += step.perform(context, t)
         return result
 
+    def total_duration(self) -> float:
+        return min(step.total_duration() for step in self.steps)
+
+    def seek(self, t: float):
+        for step in self.steps:
+            step.seek(t)
+
+    def reset(self):
+        for step in self.steps:
+            step.reset()
+
 
 @dataclass
 class PartialStep(Step):
     step: Step = None
     airshow_ids: Collection = None
 
+    def __post_init__(self):
+        # subsets by the id of the parent context, with the parent to keep the id from being reused
+        self.contexts: Dict[int, Tuple[StepContext, StepContext]] = {}
+
     def perform(self, context: StepContext, t: float) -> StepResult:
-        new_context = dataclasses.replace(context)
-        new_context.drones = [drone for drone in context.drones if drone.airshow_id in self.airshow_ids]
-        return self.step.perform(new_context, t)
+        # the runner keeps its contexts between ticks, so the partition is only done when one of them is new
+        entry = self.contexts.get(id(context))
+        if entry is None:
+            if len(self.contexts) >= 8:
+                self.contexts.clear()
+            entry = self.contexts[id(context)] = (context, context.subset(self.airshow_ids))
+        return self.step.perform(entry[1], t)
+
+    def total_duration(self) -> float:
+        return self.step.total_duration()
+
+    def seek(self, t: float):
+        self.step.seek(t)
+
+    def reset(self):
+        self.step.reset()
 
 
 def vec3_to_vector3(v: vec3) -> Vector3:
@@ -0,0 +1,145 @@
+import argparse
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+from polar_utils import state_error_components
+from steps import Step, CompositeStep
+
+
+def section_label(step: Step) -> str:
+    if type(step) is CompositeStep:
+        return "+".join(type(child).__name__ for child in step.steps)
+    return type(step).__name__
+
+
+class EvaluationRecorder:
+    """
+    Ring buffer of every evaluated frame of every player: the player's state and the state it should have had.
+    EvaluateStep writes both for all players into the preallocated rows at once.
+    The error components are derived after the round.
+    """
+
+    def __init__(self, capacity: int = 120 * 60 * 5):
+        self.capacity = capacity
+        self.times = np.zeros(capacity)
+        self.sections = np.zeros(capacity, dtype=np.int32)
+        self.slots = np.zeros(capacity, dtype=np.int32)
+        self.states = np.zeros((capacity, 3, 5))
+        self.targets = np.zeros((capacity, 3, 5))
+        self.section_names: List[str] = []
+        self.owner = None
+        # rows [head, end) hold the frames of the previous lap around the buffer, [0, head) the newest ones
+        self.head = 0
+        self.end = 0
+
+    def reset(self):
+        self.head = 0
+        self.end = 0
+
+    def start(self, owner: CompositeStep):
+        """
+        Takes the section names from the children of the evaluated step
+        """
+        self.owner = owner
+        self.section_names = [f"{i} {section_label(step)}" for i, step in enumerate(owner.steps)]
+
+    def begin_frame(self, t: float, section: int, airshow_ids: List[int]) -> slice:
+        """
+        Returns the rows where the states and targets of the players in the given slots go.
+        The rows of a frame are contiguous, so they can be computed into with out=.
+        """
+        n = len(airshow_ids)
+        if self.head + n > self.capacity:
+            self.end = self.head
+            self.head = 0
+        rows = slice(self.head, self.head + n)
+        self.times[rows] = t
+        self.sections[rows] = section
+        self.slots[rows] = airshow_ids
+        self.head += n
+        self.end = max(self.end, self.head)
+        return rows
+
+    def order(self) -> np.ndarray:
+        """
+        Indices of the recorded rows, oldest first
+        """
+        return np.concatenate([np.arange(self.head, self.end), np.arange(self.head)])
+
+    def error_components(self) -> np.ndarray:
+        """
+        Position, velocity and orientation error of every recorded frame, oldest first, shape (n, 3)
+        """
+        order = self.order()
+        return state_error_components(self.states[order], self.targets[order])
+
+    def breakdown(self, airshow_id: int = None) -> List[dict]:
+        """
+        Score and mean error components of each section, in the order they were performed,
+        of the player in the given slot or of all players together
+        """
+        order = self.order()
+        components = self.error_components()
+        if airshow_id is not None:
+            player = self.slots[order] == airshow_id
+            order, components = order[player], components[player]
+        errors = components.sum(axis=1)
+        sections = self.sections[order]
+        times = self.times[order]
+
+        rows = []
+        for section in dict.fromkeys(sections.tolist()):
+            mask = sections == section
+            worst = np.argmax(np.where(mask, errors, -np.inf))
+            rows.append({
+                "section": self.section_names[section] if section < len(self.section_names) else str(section),
+                "frames": int(mask.sum()),
+                "score": int(np.mean(1 - errors[mask] / 10) * 1000),
+                "position": float(components[mask, 0].mean()),
+                "velocity": float(components[mask, 1].mean()),
+                "orientation": float(components[mask, 2].mean()),
+                "worst_time": float(times[worst]),
+            })
+        return rows
+
+    def save(self, path: Path):
+        order = self.order()
+        np.savez_compressed(path, times=self.times[order], sections=self.sections[order], slots=self.slots[order],
+                            states=self.states[order], targets=self.targets[order],
+                            section_names=np.array(self.section_names))
+
+    @staticmethod
+    def load(path: Path) -> "EvaluationRecorder":
+        data = np.load(path)
+        recorder = EvaluationRecorder(max(len(data["times"]), 1))
+        count = recorder.head = recorder.end = len(data["times"])
+        recorder.times[:count] = data["times"]
+        recorder.sections[:count] = data["sections"]
+        if "slots" in data:
+            recorder.slots[:count] = data["slots"]
+        recorder.states[:count] = data["states"]
+        recorder.targets[:count] = data["targets"]
+        recorder.section_names = data["section_names"].tolist()
+        return recorder
+
+
+def print_breakdown(rows: List[dict]):
+    print(f"{'section':<40}{'frames':>8}{'score':>8}{'position':>10}{'velocity':>10}{'orient':>10}{'worst t':>10}")
+    for row in rows:
+        print(f"{row['section']:<40}{row['frames']:>8}{row['score']:>8}{row['position']:>10.3f}"
+              f"{row['velocity']:>10.3f}{row['orientation']:>10.3f}{row['worst_time']:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-section breakdown of a recorded evaluation, "
+                                                 "AIRSHOW_TELEMETRY=<directory> records one per round")
+    parser.add_argument("path", help="evaluation-*.npz")
+    parser.add_argument("--slot", type=int, help="only the player in this formation slot")
+    args = parser.parse_args()
+    print_breakdown(EvaluationRecorder.load(Path(args.path)).breakdown(args.slot))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import argparse
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import List, Tuple, Optional
+
+from steps import Step, CompositeStep, ParallelStep, PartialStep
+
+
+@dataclass
+class TimelineEntry:
+    start: float
+    end: float
+    step: Step
+    path: Tuple[int, ...]
+
+    @property
+    def label(self) -> str:
+        return "/".join(map(str, self.path)) + " " + type(self.step).__name__
+
+    @property
+    def is_leaf(self) -> bool:
+        return not isinstance(self.step, (CompositeStep, ParallelStep, PartialStep))
+
+
+class Timeline:
+    """
+    A step tree flattened into start and end times of every step.
+    Times are nominal: each step is assumed to take exactly its duration.
+    """
+
+    def __init__(self, root: Step):
+        self.root = root
+        self.entries: List[TimelineEntry] = []
+        self.add(root, 0.0, (), float("inf"))
+        self.entries.sort(key=lambda entry: (entry.start, len(entry.path)))
+        self.duration = root.total_duration()
+
+        # built on the first lookup by time, the runner only seeks
+        self.boundaries: Optional[List[float]] = None
+        self.segments: Optional[List[List[TimelineEntry]]] = None
+
+    def build_segments(self):
+        """
+        The leaves that run between each pair of consecutive boundaries, for lookups by time
+        """
+        leaves = [entry for entry in self.entries if entry.is_leaf and entry.end > entry.start]
+        self.boundaries = sorted({entry.start for entry in leaves} | {entry.end for entry in leaves})
+        self.segments = [
+            [entry for entry in leaves if entry.start <= start < entry.end] for start in self.boundaries
+        ]
+
+    def add(self, step: Step, start: float, path: Tuple[int, ...], limit: float):
+        # children of a ParallelStep stop with the shortest of them
+        end = min(start + step.total_duration(), limit)
+        self.entries.append(TimelineEntry(start, end, step, path))
+
+        if isinstance(step, CompositeStep):
+            for i, (child, child_start) in enumerate(zip(step.steps, step.child_starts())):
+                self.add(child, start + child_start, path + (i,), end)
+        elif isinstance(step, ParallelStep):
+            for i, child in enumerate(step.steps):
+                self.add(child, start, path + (i,), end)
+        elif isinstance(step, PartialStep):
+            self.add(step.step, start, path + (0,), end)
+
+    def at(self, t: float) -> List[TimelineEntry]:
+        """
+        The leaf steps that run at time t
+        """
+        if self.segments is None:
+            self.build_segments()
+        index = bisect_right(self.boundaries, t) - 1
+        return self.segments[index] if index >= 0 else []
+
+    def seek(self, t: float):
+        self.root.seek(t)
+
+    def sections(self, depth: int) -> List[TimelineEntry]:
+        return [entry for entry in self.entries if len(entry.path) == depth]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the timeline of the choreography, "
+                                                 "AIRSHOW_START_AT=<seconds> starts the show at one of these times")
+    parser.add_argument("--depth", type=int, default=None, help="only show steps this deep in the tree")
+    parser.add_argument("--at", type=float, default=None, help="only show the steps that run at this time")
+    args = parser.parse_args()
+
+    import choreography
+    from headless import HeadlessGame
+
+    game = HeadlessGame()
+    runner = choreography.Choreography(game.game_interface, game.simulation.packet)
+    runner.generate_sequence()
+
+    timeline = Timeline(runner.step)
+    for entry in timeline.entries if args.at is None else timeline.at(args.at):
+        if args.depth is None or len(entry.path) == args.depth:
+            print(f"{entry.start:8.2f} {entry.end:8.2f}  {'  ' * len(entry.path)}{entry.label}")
+
+
+if __name__ == '__main__':
+    main()